@@ -0,0 +1,152 @@
+# MCTS versus DP agreement for Hoot Owl Hoot
+# Samples (state, hand) positions from games played by the DP agent, solves them
+# once with the DP agent's value table and then runs MCTS on every position at a
+# ladder of iteration counts. For each iteration count it reports how often MCTS
+# picks a move as good as the DP agent's and the regret, the win probability lost
+# by MCTS's move compared to the best move, along with the time taken per
+# decision. Positions are split across worker processes, which all share the
+# solved table.
+import sys
+import json
+import time
+import random
+import multiprocessing
+from engine import cards, card_weights, is_terminal, legal_moves, successor, parse_state, parse_options
+from engine import run_parallel, worker_seeds
+import dp_agent
+import mcts_agent
+
+# Moves whose values are within this of each other are treated as equally good
+tolerance = 1e-9
+
+
+def move_values(state, set_cards):
+    # DP win probability of the state every move we can make with our cards leads to
+    return [(dp_agent.calculate_value(list(successor(state, move))), move) for move in legal_moves(state, set_cards)]
+
+
+def sample_positions(start_state, num_positions, rng):
+    # Plays games with the DP agent and collects the positions where the choice of
+    # move matters, with the DP values of the moves we can make from them. Positions
+    # where every move is equally good (including every hand with a sun card) can't
+    # tell the agents apart, so they're skipped. Returns the positions and the
+    # number of games played.
+    positions = []
+    games = 0
+    while len(positions) < num_positions:
+        games += 1
+        state = tuple(start_state)
+        random_cards = rng.choices(cards, card_weights, k=3)
+        while not is_terminal(state) and len(positions) < num_positions:
+            values = move_values(state, random_cards)
+            best_value = max(value for value, move in values)
+            if best_value - min(value for value, move in values) > tolerance:
+                positions.append((list(state), list(random_cards), [value for value, move in values]))
+            value, move = next((value, move) for value, move in values if value == best_value)
+            state = successor(state, move)
+            random_cards.remove(move[0])
+            random_cards.append(rng.choices(cards, card_weights)[0])
+    return positions, games
+
+
+def run_ladder(positions, ladder, seed):
+    # Runs MCTS on every position at every iteration count and returns the DP value
+    # of the move it picked and the time taken for each. MCTS can fail to visit any
+    # of our moves with very few iterations, and then counts as picking the first.
+    rng = random.Random(seed)
+    results = []
+    for state, set_cards, values in positions:
+        moves = legal_moves(state, set_cards)
+        picks = []
+        for iterations in ladder:
+            start_time = time.perf_counter()
+            try:
+                value, card, i, new_state = mcts_agent.get_best_action(state, set_cards, iterations,
+                                                                        seed=rng.getrandbits(64))
+                pick = next(k for k, move in enumerate(moves) if list(successor(state, move)) == new_state)
+            except ValueError:
+                pick = 0
+            picks.append((values[pick], time.perf_counter() - start_time))
+        results.append(picks)
+    return results
+
+
+def summarize(positions, results, ladder):
+    # Agreement rate, mean and worst regret and time per decision for every
+    # iteration count
+    rows = []
+    for level, iterations in enumerate(ladder):
+        regrets = [max(values) - picks[level][0] for (state, set_cards, values), picks in zip(positions, results)]
+        seconds = sum(picks[level][1] for picks in results)
+        rows.append({
+            "iterations": iterations,
+            "agreement": sum(regret <= tolerance for regret in regrets) / len(regrets),
+            "mean_regret": sum(regrets) / len(regrets),
+            "max_regret": max(regrets),
+            "ms_per_decision": seconds / len(regrets) * 1000,
+        })
+    return rows
+
+
+def main():
+    args, options = parse_options(sys.argv[1:])
+    if len(args) > 1 or "help" in options:
+        print("Usage: python3 agreement.py [<state>] [--positions=<n>] [--iterations=100,1000,10000] " +
+              "[--workers=<n>] [--seed=<n>] [--load-table=<file>] [--output=<file>]")
+        exit(0)
+    state = parse_state(args[0] if args else "5,4,3,0")
+    try:
+        num_positions = int(options.get("positions", 1000))
+        ladder = [int(x) for x in str(options.get("iterations", "100,300,1000,3000,10000")).split(",")]
+        workers = int(options.get("workers", multiprocessing.cpu_count()))
+        seed = int(options.get("seed", 1))
+    except ValueError:
+        print("Invalid option inputted. Positions, iterations, workers and seed should be integers.")
+        exit(1)
+    if num_positions < 1 or workers < 1 or min(ladder) < 1:
+        print("Invalid option inputted. Positions, iterations and workers should be positive.")
+        exit(1)
+
+    # Solve once before starting any workers so they all share the same table
+    start_time = time.perf_counter()
+    if "load-table" in options:
+        try:
+            dp_agent.memo = dp_agent.ValueTable.load(options["load-table"])
+        except (OSError, ValueError) as e:
+            print("Could not load value table: " + str(e))
+            exit(1)
+        if dp_agent.memo.num_owls != len(state) - 1:
+            print("Value table was solved for " + str(dp_agent.memo.num_owls) + " owls, not " +
+                  str(len(state) - 1) + ".")
+            exit(1)
+    dp_agent.solve(state, "iterative")
+    positions, games = sample_positions(state, num_positions, random.Random(seed))
+    print("Solved and sampled " + str(len(positions)) + " positions from " + str(games) + " games in " +
+          str(round(time.perf_counter() - start_time, 2)) + " seconds", file=sys.stderr)
+
+    # Every worker gets an equal share of the positions and runs the whole ladder
+    # on them
+    workers = min(workers, len(positions))
+    shares = [positions[k::workers] for k in range(workers)]
+    start_time = time.perf_counter()
+    worker_results = run_parallel(lambda share, seed: run_ladder(share, ladder, seed),
+                                  list(zip(shares, worker_seeds(seed, workers))))
+    wall_time = time.perf_counter() - start_time
+    results = []
+    for k in range(len(positions)):
+        results.append(worker_results[k % workers][k // workers])
+
+    rows = summarize(positions, results, ladder)
+    print("iterations,agreement,mean_regret,max_regret,ms_per_decision")
+    for row in rows:
+        print(",".join(str(round(row[name], 6)) for name in row))
+    print("MCTS took " + str(round(wall_time, 2)) + " seconds with " + str(workers) + " workers", file=sys.stderr)
+    if "output" in options:
+        report = {"state": state, "positions": len(positions), "games": games, "seed": seed,
+                  "workers": workers, "wall_seconds": wall_time, "results": rows}
+        with open(options["output"], "w") as f:
+            f.write(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
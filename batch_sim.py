@@ -0,0 +1,127 @@
+# Vectorized game simulator for the num_games evaluation mode.
+# Plays thousands of games at once using NumPy arrays of owl positions, sun
+# positions and hands. Cards are stored as their index in cards, so the sun card
+# is len(cards) - 1. Each agent's policy is a function that picks a hand slot and
+# an owl for every game in the batch.
+import math
+import numpy as np
+from engine import cards, board_len, sun_len, next_square
+
+nest = board_len - 1
+sun_card = len(cards) - 1
+
+# next_squares[card, pos] is next_square as an array, with a row of nests for the sun
+next_squares = np.array([next_square[card] for card in cards[:-1]] + [[nest] * board_len])
+
+# binomials[a, k] is a choose k, used to compute packed value table indexes
+binomials = np.array([[math.comb(a, k) for k in range(8)] for a in range(board_len)])
+
+
+def destinations(owls, hands):
+    # Returns dest[game, slot, owl], the square each owl would move to when playing
+    # each card in the hand, skipping squares taken by other owls
+    colors = hands[:, :, None]
+    dest = next_squares[colors, owls[:, None, :]]
+    for _ in range(owls.shape[1] - 1):
+        occupied = (dest[..., None] == owls[:, None, None, :]).any(axis=-1) & (dest != nest)
+        if not occupied.any():
+            break
+        dest = np.where(occupied, next_squares[colors, dest], dest)
+    return dest
+
+
+def greedy_policy(owls, sun, hands, dest, rng):
+    # Move that makes the most forward progress, and on ties the card that comes
+    # first in cards and then the owl furthest ahead, like greedy_agent.py
+    progress = np.where(owls[:, None, :] != nest, dest - owls[:, None, :], -1)
+    order = (progress * len(cards) + sun_card - hands[:, :, None]) * board_len + owls[:, None, :]
+    best = order.reshape(len(owls), -1).argmax(axis=1)
+    return np.divmod(best, owls.shape[1])
+
+
+def rule_policy(front):
+    # Random card from the hand, moving the owl furthest ahead (front) or behind (back)
+    def policy(owls, sun, hands, dest, rng):
+        if front:
+            owl = np.where(owls != nest, owls, -1).argmax(axis=1)
+        else:
+            owl = np.where(owls != nest, owls, board_len).argmin(axis=1)
+        slot = rng.integers(0, hands.shape[1], len(owls))
+        return slot, owl
+    return policy
+
+
+def dp_policy(table):
+    # Move leading to the state with the highest value in a solved packed ValueTable
+    values = np.frombuffer(table.values, dtype=np.float32 if table.typecode == "f" else np.float64)
+    if table.overlay:
+        values = values.copy()
+        values[list(table.overlay)] = list(table.overlay.values())
+    offsets = np.array(table.offsets)
+
+    def policy(owls, sun, hands, dest, rng):
+        num_games, num_slots, num_owls = dest.shape
+        # after[game, slot, owl] is the owl positions after moving that owl
+        after = np.broadcast_to(owls[:, None, None, :], (num_games, num_slots, num_owls, num_owls)).copy()
+        moved = np.arange(num_owls)
+        after[:, :, moved, moved] = dest
+        after.sort(axis=-1)
+        off_nest = (after != nest).sum(axis=-1)
+        rank = offsets[off_nest]
+        for k in range(num_owls):
+            rank += np.where(after[..., k] != nest, binomials[after[..., k], k + 1], 0)
+        value = values[sun[:, None, None] * table.num_configs + rank]
+        value = np.where(owls[:, None, :] != nest, value, -1)
+        best = value.reshape(num_games, -1).argmax(axis=1)
+        return np.divmod(best, num_owls)
+    return policy
+
+
+def play_batch(policy, start_state, num_games, probabilities, rng):
+    # Plays num_games games from start_state and returns the number of wins
+    owls = np.tile(np.array(start_state[:-1]), (num_games, 1))
+    sun = np.full(num_games, start_state[-1])
+    hands = rng.choice(len(cards), size=(num_games, 3), p=probabilities)
+    wins = 0
+    while len(owls):
+        # Drop finished games
+        won = (owls == nest).all(axis=1)
+        lost = sun == sun_len - 1
+        wins += int((won & ~lost).sum())
+        playing = ~(won | lost)
+        owls, sun, hands = owls[playing], sun[playing], hands[playing]
+        if not len(owls):
+            break
+
+        # Sun cards have to be played, otherwise ask the policy for a move
+        has_sun = (hands == sun_card).any(axis=1)
+        played = np.where(has_sun, sun_card, 0)
+        move = np.flatnonzero(~has_sun)
+        if len(move):
+            dest = destinations(owls[move], hands[move])
+            slot, owl = policy(owls[move], sun[move], hands[move], dest, rng)
+            owls[move, owl] = dest[np.arange(len(move)), slot, owl]
+            played[move] = hands[move, slot]
+        sun += has_sun
+
+        # Remove the first copy of the played card and draw a new card at the end
+        removed = (hands == played[:, None]).argmax(axis=1)
+        order = np.argsort(np.arange(3)[None, :] == removed[:, None], axis=1, kind="stable")
+        hands = np.take_along_axis(hands, order, axis=1)
+        hands[:, -1] = rng.choice(len(cards), size=len(hands), p=probabilities)
+    return wins
+
+
+def simulate(policy, start_state, num_games, probabilities, seed=None, batch_size=10000):
+    # Plays num_games games in batches and returns the number of wins
+    rng = np.random.default_rng(seed)
+    wins = 0
+    for start in range(0, num_games, batch_size):
+        wins += play_batch(policy, start_state, min(batch_size, num_games - start), probabilities, rng)
+    return wins
+
+
+def confidence_interval(wins, num_games):
+    # Half-width of the 95% confidence interval for the win percentage
+    p = wins / num_games
+    return 1.96 * math.sqrt(p * (1 - p) / num_games) * 100
@@ -0,0 +1,184 @@
+# Benchmarks for Hoot Owl Hoot
+# Times the DP solver from the starting position, the num_games loop of every
+# agent and MCTS iterations. Every benchmark runs in a fresh process, so its peak
+# memory isn't affected by the ones before it and nothing is already solved, and
+# is repeated to keep its fastest run. The results are written as JSON and can be
+# compared against a saved baseline to catch performance regressions.
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import multiprocessing
+from engine import parse_options
+
+# Metrics where a lower number is better. The rest are rates, where higher is better.
+lower_is_better = ("seconds", "peak_mb")
+
+# Option that sets how much work each kind of benchmark does. Their times and
+# memory grow with it, so only their rates can be compared with a baseline that
+# used a different value.
+workload_options = {"games_": "games", "mcts_": "iterations"}
+
+
+def start_state(num_owls):
+    # Starting position for a number of owls, with the owls on the first squares
+    return list(range(5, 5 - num_owls, -1)) + [0]
+
+
+def peak_mb():
+    # Peak memory of this process so far, in megabytes (ru_maxrss is in kilobytes)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_solver(num_owls):
+    # Solves the game from the starting position with calculate_value
+    import dp_agent
+    sys.setrecursionlimit(10000)
+    start_time = time.perf_counter()
+    value = dp_agent.calculate_value(start_state(num_owls))
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "peak_mb": peak_mb(), "states": len(dp_agent.memo), "value": value}
+
+
+def bench_games(agent, num_games):
+    # Plays num_games games from the 3 owl starting position with an agent's
+    # play_games. The DP agent is solved first and the solve isn't timed.
+    state = start_state(3)
+    rng = random.Random(1)
+    if agent == "dp":
+        import dp_agent
+        dp_agent.calculate_value(state)
+        play = lambda: dp_agent.play_games(state, num_games, rng)
+    elif agent == "greedy":
+        import greedy_agent
+        play = lambda: greedy_agent.play_games(state, num_games, rng)
+    else:
+        import rulebased_agent
+        play = lambda: rulebased_agent.play_games(state, num_games, agent == "front", rng)
+    start_time = time.perf_counter()
+    wins = play()
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "games_per_second": num_games / seconds, "win_rate": wins / num_games}
+
+
+def bench_mcts(num_owls, iterations):
+    # Runs MCTS from the starting position
+    import mcts_agent
+    stats, count, seconds, counters = mcts_agent.search(start_state(num_owls), iterations, seed=1)
+    return {"seconds": seconds, "iterations_per_second": count / seconds, "peak_mb": peak_mb(),
+            "nodes": counters["nodes"]}
+
+
+def run_benchmark(task, args):
+    # Runs a benchmark in a new process and returns its results
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(task, args)
+
+
+def best_run(task, args, repeat):
+    # Runs a benchmark repeat times and returns the results of the fastest run.
+    # Other work on the machine can only slow a run down, so the fastest run is
+    # the one that changes least from one time to the next.
+    runs = [run_benchmark(task, args) for _ in range(repeat)]
+    return min(runs, key=lambda results: results["seconds"])
+
+
+def compare(results, options, baseline, baseline_options, tolerance):
+    # Returns the comparison of every metric with the baseline, and the names of
+    # the metrics that got worse by more than the tolerance
+    comparison = {}
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        same_workload = all(options[option] == baseline_options.get(option)
+                            for prefix, option in workload_options.items() if name.startswith(prefix))
+        for metric, value in metrics.items():
+            if metric in lower_is_better:
+                if not same_workload:
+                    continue
+            elif not metric.endswith("_per_second"):
+                continue
+            old = baseline[name].get(metric)
+            if not old:
+                continue
+            change = value / old - 1
+            comparison[name + "." + metric] = {"baseline": old, "current": value, "change": change}
+            worse = change > tolerance if metric in lower_is_better else change < -tolerance
+            if worse:
+                regressions.append(name + "." + metric)
+    return comparison, regressions
+
+
+def main():
+    args, options = parse_options(sys.argv[1:])
+    if args or "help" in options:
+        print("Usage: python3 benchmark.py [--owls=3,4] [--games=<n>] [--iterations=<n>] " +
+              "[--repeat=<n>] [--output=<file>] [--baseline=<file>] [--tolerance=<fraction>]")
+        exit(0)
+    try:
+        owl_counts = [int(x) for x in str(options.get("owls", "3,4")).split(",")]
+        num_games = int(options.get("games", 2000))
+        iterations = int(options.get("iterations", 20000))
+        repeat = int(options.get("repeat", 3))
+        tolerance = float(options.get("tolerance", 0.25))
+    except ValueError:
+        print("Invalid option inputted. Owls, games, iterations and repeat should be integers.")
+        exit(1)
+    if any(n < 3 or n > 6 for n in owl_counts):
+        print("Invalid number of owls inputted. Please input 3-6 owls.")
+        exit(1)
+    if repeat < 1:
+        print("Invalid repeat inputted. Please input at least 1.")
+        exit(1)
+
+    benchmarks = []
+    for num_owls in owl_counts:
+        benchmarks.append(("solver_" + str(num_owls) + "_owls", bench_solver, (num_owls,)))
+    for agent in ("dp", "greedy", "front", "back"):
+        benchmarks.append(("games_" + agent, bench_games, (agent, num_games)))
+    for num_owls in (3, 5):
+        benchmarks.append(("mcts_" + str(num_owls) + "_owls", bench_mcts, (num_owls, iterations)))
+
+    results = {}
+    for name, task, task_args in benchmarks:
+        results[name] = best_run(task, task_args, repeat)
+        print(name + ": " + ", ".join(metric + " " + str(round(value, 3))
+                                      for metric, value in results[name].items()), file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "options": {"games": num_games, "iterations": iterations, "repeat": repeat},
+        "results": results,
+    }
+    regressions = []
+    if "baseline" in options:
+        try:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Could not load baseline: " + str(e))
+            exit(1)
+        report["comparison"], regressions = compare(results, report["options"], baseline["results"],
+                                                    baseline.get("options", {}), tolerance)
+        report["regressions"] = regressions
+        for name in regressions:
+            change = report["comparison"][name]["change"]
+            print("Regression: " + name + " changed by " + str(round(change * 100, 1)) + "%", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if "output" in options:
+        with open(options["output"], "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if regressions:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
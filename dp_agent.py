@@ -1,54 +1,263 @@
 # Value Iteration/DP Agent for Hoot Owl Hoot
+import os
 import sys
+import math
+import time
+import mmap
 import random
+import struct
+import heapq
+import bisect
+import hashlib
+from array import array
+from engine import board, cards, board_len, sun_len, card_probabilities, card_weights, is_terminal
+from engine import next_square, next_position, legal_moves, successor, simulate_games, hands, hand_index
+from engine import parse_state, parse_cards, parse_options, run_games, worker_options, run_batch
+from traces import trace_option
 
-# Taken from a real photo of the game board starting from 3rd owl position.
-# Colors: blue, purple, red, yellow, green, orange
-# nest is the end of the game
-board = ["yellow", "green", "orange", "blue", "purple", "red", "blue", "purple", 
-         "red", "yellow", "green", "blue", "orange", "red", "purple", "yellow", 
-         "green", "orange", "blue", "purple", "red", "green", "yellow", "orange", 
-         "blue", "purple", "red", "yellow", "green", "blue", "orange", "red", 
-         "purple", "yellow", "green", "blue", "orange", "red", "purple", "nest"]
-
-
-cards = ["blue", "purple", "red", "yellow", "green", "orange", "sun"]
-
-board_len = len(board)
-sun_len = 14
-
-# Uniform probability distribution based on real deck.
-# Six cards of each color and 14 sun cards.
-card_probabilities = {
-    "blue": 0.12,
-    "purple": 0.12,
-    "red": 0.12,
-    "yellow": 0.12,
-    "green": 0.12,
-    "orange": 0.12,
-    "sun": 0.28
-}
-
-# Stores the values of each state
+# Stores the values of each state, keyed by canonical state
 memo = {}
 
-def is_terminal(state):
-    # Checks that either the sun has reached the end or all owls are at the end
-    return state[-1] == sun_len - 1 or all([pos == board_len - 1 for pos in state[:-1]])
+# Position of each card in card order, for breaking ties between moves
+card_rank = {card: c for c, card in enumerate(cards)}
+
+# binomials[a][k] is a choose k, used to pack owl positions into a single index
+binomials = [[math.comb(a, k) for k in range(8)] for a in range(board_len)]
+
+# Value table file format: a fixed-size header followed by the raw array of values.
+# The header holds the magic bytes, format version, byte order, array typecode,
+# number of owls, number of values, number of solved states and a fingerprint of
+# the game configuration.
+TABLE_MAGIC = b"HOOTVAL\0"
+TABLE_VERSION = 2
+TABLE_HEADER = struct.Struct("<8sHccBQQ32s")
+TABLE_DATA_OFFSET = 64
+
+# Policy tables use the same header with their own magic bytes
+POLICY_MAGIC = b"HOOTPOL\0"
+
+def read_table_header(mapped, path, magic, kind):
+    # Checks the header of a mapped table file and returns its typecode, number of
+    # owls, length and number of solved states. Raises ValueError if the file is not a table of this kind or
+    # was solved for a different board or card probabilities.
+    if len(mapped) < TABLE_DATA_OFFSET or mapped[:len(magic)] != magic:
+        raise ValueError(path + " is not a " + kind)
+    magic, version, byteorder, typecode, num_owls, length, solved, fingerprint = \
+        TABLE_HEADER.unpack_from(mapped)
+    if version != TABLE_VERSION:
+        raise ValueError(path + " uses " + kind + " format version " + str(version) +
+                         ", expected " + str(TABLE_VERSION))
+    if byteorder != sys.byteorder[0].encode():
+        raise ValueError(path + " was saved on a machine with a different byte order")
+    if fingerprint != table_fingerprint():
+        raise ValueError(path + " is stale: it was solved for a different board, " +
+                         "sun track or card probabilities")
+    return typecode.decode(), num_owls, length, solved
+
+def canonical_state(state):
+    # Owls are interchangeable, so states that only differ in the order of the owls
+    # have the same value. Sorting the owl positions gives one key for all of them.
+    return tuple(sorted(state[:-1], reverse=True)) + (state[-1],)
+
+def table_fingerprint():
+    # Identifies the board, sun track and card probabilities a table was solved with
+    config = repr((board, sun_len, [(card, card_probabilities[card]) for card in cards]))
+    return hashlib.sha256(config.encode()).digest()
+
+class ValueTable:
+    # Compact replacement for the memo dict. Every canonical state is packed into a
+    # single integer index and its value is stored in a preallocated array, so each
+    # state costs 8 bytes (4 with float32) rather than a tuple, a dict slot and a
+    # float object. Unsolved states hold NaN.
+    #
+    # Owls off the nest always sit on distinct squares, so a configuration is a set
+    # of squares 0-38 plus a count of owls at the nest. Configurations are grouped
+    # by the number of owls off the nest (most first) and ranked within a group with
+    # the combinatorial number system, so moving an owl forward always increases
+    # the index. The sun is the most significant part of the index, which means
+    # every successor of a state has a larger index than the state itself.
+    def __init__(self, num_owls, typecode="d", values=None, solved=0):
+        self.num_owls = num_owls
+        self.typecode = typecode
+        self.offsets = [0] * (num_owls + 1)
+        total = 0
+        for off_nest in range(num_owls, -1, -1):
+            self.offsets[off_nest] = total
+            total += binomials[board_len - 1][off_nest]
+        self.num_configs = total
+        if values is None:
+            values = array(typecode, [math.nan]) * (sun_len * total)
+        self.values = values
+        # Counting the solved states would mean scanning every value, so the count
+        # is kept up to date as states are solved
+        self.solved = solved
+        # Tables loaded from disk are mapped read-only, so states solved afterwards
+        # are kept in this overlay instead
+        self.readonly = isinstance(values, memoryview) and values.readonly
+        self.overlay = {}
+
+    def save(self, path):
+        # Writes the table to disk in the versioned value table format
+        values = self.values
+        if self.readonly:
+            values = array(self.typecode, values)
+            for index, value in self.overlay.items():
+                values[index] = value
+        header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, sys.byteorder[0].encode(),
+                                   self.typecode.encode(), self.num_owls, len(values),
+                                   len(self), table_fingerprint())
+        with open(path, "wb") as f:
+            f.write(header.ljust(TABLE_DATA_OFFSET, b"\0"))
+            f.write(values)
+
+    @classmethod
+    def load(cls, path):
+        # Memory-maps a saved table read-only. Raises ValueError if the file is not
+        # a value table or was solved for a different board or card probabilities.
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        typecode, num_owls, length, solved = read_table_header(mapped, path, TABLE_MAGIC, "value table")
+        values = memoryview(mapped)[TABLE_DATA_OFFSET:]
+        # Casting fails on any other typecode or a partial value at the end
+        if typecode not in ("d", "f") or len(values) % array(typecode).itemsize or not 3 <= num_owls <= 6:
+            raise ValueError(path + " is truncated or corrupt")
+        values = values.cast(typecode)
+        table = cls(num_owls, typecode, values, solved)
+        if len(values) != length or length != sun_len * table.num_configs or solved > length:
+            raise ValueError(path + " is truncated or corrupt")
+        table.mapped = mapped
+        return table
+
+    def get(self, index):
+        value = self.values[index]
+        if value != value and self.overlay:
+            return self.overlay.get(index, value)
+        return value
+
+    def put(self, index, value):
+        if self.readonly:
+            self.overlay[index] = value
+        else:
+            old = self.values[index]
+            if old != old:
+                self.solved += 1
+            self.values[index] = value
+
+    def index(self, state):
+        # Packs a state (in any owl order) into its index in the table
+        owls = sorted([pos for pos in state[:-1] if pos != board_len - 1])
+        rank = self.offsets[len(owls)]
+        for k in range(len(owls)):
+            rank += binomials[owls[k]][k + 1]
+        return state[-1] * self.num_configs + rank
+
+    def squares(self, rank):
+        # Unpacks the rank of a configuration into the squares of the owls off the
+        # nest, furthest first
+        off_nest = self.num_owls
+        while rank >= self.offsets[off_nest] + binomials[board_len - 1][off_nest]:
+            off_nest -= 1
+        rank -= self.offsets[off_nest]
+        owls = []
+        pos = board_len - 2
+        for k in range(off_nest, 0, -1):
+            while binomials[pos][k] > rank:
+                pos -= 1
+            owls.append(pos)
+            rank -= binomials[pos][k]
+            pos -= 1
+        return owls
+
+    def state(self, index):
+        # Unpacks an index back into a canonical state
+        sun, rank = divmod(index, self.num_configs)
+        owls = self.squares(rank)
+        return (board_len - 1,) * (self.num_owls - len(owls)) + tuple(owls) + (sun,)
+
+    def successor_indexes(self, index):
+        # Indexes of every state reachable in one move from the non-terminal state
+        # at index, in the same order as successors(), worked out from the ranks
+        # without building any states.
+        # Moving an owl from square a to square b only changes the terms of the owls
+        # from a up to b: the moved owl's term is replaced by b's, and every owl it
+        # jumps over moves down one place in the order.
+        owls = self.squares(index % self.num_configs)[::-1]
+        moving = len(owls)
+        drops = [binomials[pos][k] - binomials[pos][k + 1] for k, pos in enumerate(owls)]
+        home = self.offsets[moving - 1] - self.offsets[moving]
+        next_indexes = [index + self.num_configs]
+        for card in cards[:-1]:
+            squares = next_square[card]
+            for j in range(moving - 1, -1, -1):
+                pos = squares[owls[j]]
+                while pos in owls:
+                    pos = squares[pos]
+                next_index = index - binomials[owls[j]][j + 1]
+                k = j + 1
+                while k < moving and owls[k] < pos:
+                    next_index += drops[k]
+                    k += 1
+                if pos == board_len - 1:
+                    next_index += home
+                else:
+                    next_index += binomials[pos][k]
+                next_indexes.append(next_index)
+        return next_indexes
+
+    def terminal(self, index):
+        # Whether the state at index is terminal: the sun is the most significant
+        # part of an index, and offsets[0] is the rank with every owl at the nest
+        return index >= (sun_len - 1) * self.num_configs or index % self.num_configs == self.offsets[0]
+
+    def reachable(self, start, solved=False):
+        # Marks every state reachable from the state at index start in a bytearray
+        # over the indexes. Successors only ever have larger indexes, so one pass
+        # in index order finds them all. Solved states aren't followed unless
+        # solved is True.
+        get = self.get if self.readonly else self.values.__getitem__
+        reached = bytearray(len(self.values))
+        reached[start] = 1
+        index = start
+        while index != -1:
+            if not self.terminal(index):
+                for next_index in self.successor_indexes(index):
+                    value = get(next_index)
+                    if solved or value != value:
+                        reached[next_index] = 1
+            index = reached.find(1, index + 1)
+        return reached
+
+    def __len__(self):
+        # Number of solved states
+        return self.solved + len(self.overlay)
+
+    def __contains__(self, state):
+        value = self.get(self.index(state))
+        return value == value
+
+    def __getitem__(self, state):
+        value = self.get(self.index(state))
+        if value != value:
+            raise KeyError(state)
+        return value
+
+    def __setitem__(self, state, value):
+        self.put(self.index(state), value)
 
 # Backwards induction to calculate the value of each state
 def calculate_value(state):
     # Memoized, just return the value since we've already calculated it
-    if tuple(state) in memo:
-        return memo[tuple(state)]
+    key = canonical_state(state)
+    if key in memo:
+        return memo[key]
 
     # Base case for terminal states
     if is_terminal(state):
         if state[-1] == sun_len - 1:
-            memo[tuple(state)] = 0
+            memo[key] = 0
         else:
-            memo[tuple(state)] = 1
-        return memo[tuple(state)]
+            memo[key] = 1
+        return memo[key]
 
     win_prob = 0
     for card in cards:
@@ -57,22 +266,13 @@ def calculate_value(state):
             win_prob += card_probabilities[card] * calculate_value(list(state[:-1] + [state[-1] + 1]))
         else:
             best_prob = None
-            owls = state[:-1]
             # Iterate through all owls
             for i in range(len(state) - 1):
                 # Skip if owl is already at the nest
                 if state[i] == board_len - 1:
                     continue
-                # Find the next position we can move to with the card
-                for j in range(state[i] + 1, board_len):
-                    # If we can move to the next position with the card or if it's the nest
-                    # AND no other owl is at that position or it's the nest
-                    if board[j] == "nest":
-                        next_pos = j
-                        break
-                    elif board[j] == card and j not in owls:
-                        next_pos = j
-                        break
+                # Find the next open position we can move to with the card
+                next_pos = next_position(state, i, card)
                 # Get next state and then recurse down
                 new_state = list(state)
                 new_state[i] = next_pos
@@ -80,130 +280,700 @@ def calculate_value(state):
                 if best_prob is None or action_value > best_prob:
                     best_prob = action_value
             win_prob += card_probabilities[card] * best_prob
-    memo[tuple(state)] = win_prob
+    memo[key] = win_prob
     return win_prob
 
+def move_owl(state, i, card):
+    # Returns the state after moving owl i to the next open square of the card's color
+    new_state = list(state)
+    new_state[i] = next_position(state, i, card)
+    return tuple(new_state)
+
+def successors(state):
+    # Returns every state reachable in one move from a non-terminal state, as
+    # canonical states: the sun move first, then every owl that can move for each
+    # color card in card order
+    owls = state[:-1]
+    sun = state[-1:]
+    next_states = [owls + (state[-1] + 1,)]
+    for card in cards[:-1]:
+        squares = next_square[card]
+        for i in range(len(owls)):
+            pos = owls[i]
+            if pos != board_len - 1:
+                # next_position inlined, since this runs for every move of every state
+                pos = squares[pos]
+                while pos != board_len - 1 and pos in owls:
+                    pos = squares[pos]
+                new_owls = list(owls)
+                new_owls[i] = pos
+                new_owls.sort(reverse=True)
+                next_states.append(tuple(new_owls) + sun)
+    return next_states
+
+# Bottom-up version of calculate_value that fills the memo without recursion.
+# Every move either advances the sun or moves an owl forward, so solving states
+# grouped by (sun position, total owl progress) in decreasing order guarantees
+# that all successors of a state are solved before the state itself. States are
+# numbered as they're found and each state's successors are kept as numbers, so
+# successors are only generated once and the sweep looks values up in an array
+# instead of hashing states again.
+def solve_iterative(state):
+    start = canonical_state(state)
+    if start in memo:
+        return memo[start]
+
+    # Search the levels in increasing order, numbering every state reachable from
+    # the start state. Each level keeps its unsolved states, their numbers and the
+    # numbers of their successors in one flat array. States already in the memo
+    # keep their value and aren't searched any further. A state can only be
+    # reached from lower levels, so its number is dropped once its level has been
+    # searched.
+    numbers = {start: 0}
+    values = array("d", [math.nan])
+    found = {level(start): [start]}
+    order = [level(start)]
+    searched = []
+    while order:
+        level_states = found.pop(heapq.heappop(order))
+        level_numbers = array("i")
+        next_numbers = array("i")
+        for current in level_states:
+            level_numbers.append(numbers.pop(current))
+            if is_terminal(current):
+                continue
+            for next_state in successors(current):
+                n = numbers.get(next_state)
+                if n is None:
+                    n = numbers[next_state] = len(values)
+                    value = memo.get(next_state)
+                    if value is None:
+                        values.append(math.nan)
+                        next_level = level(next_state)
+                        if next_level not in found:
+                            found[next_level] = []
+                            heapq.heappush(order, next_level)
+                        found[next_level].append(next_state)
+                    else:
+                        values.append(value)
+                next_numbers.append(n)
+        searched.append((level_states, level_numbers, next_numbers))
+    del numbers
+
+    # Sweep from the end of the game back to the start state, dropping each level
+    # once it's solved
+    while searched:
+        level_states, level_numbers, next_numbers = searched.pop()
+        j = 0
+        for current, k in zip(level_states, level_numbers):
+            if is_terminal(current):
+                value = backup(current)
+            else:
+                count = 1 + (len(cards) - 1) * (len(current) - 1 - current.count(board_len - 1))
+                value = backup(current, [values[n] for n in next_numbers[j:j + count]])
+                j += count
+            values[k] = value
+            memo[current] = value
+    return values[0]
+
+def level(state):
+    # Level of a canonical state in the iterative engine's solving order
+    return state[-1], sum(state[:-1])
+
+# Iterative engine for a ValueTable memo. The table's index order is already a
+# valid solving order, so reachable states are marked in a bitmap on a forward
+# pass over the indices and solved on a backward pass. Both passes work on the
+# indexes alone with successor_indexes, without building any states.
+def solve_packed(state):
+    table = memo
+    if state in table:
+        return table[state]
+    reached = table.reachable(table.index(state))
+    # Values solved on top of a loaded table live in its overlay
+    get = table.get if table.readonly else table.values.__getitem__
+    index = reached.rfind(1)
+    while index != -1:
+        if index >= (sun_len - 1) * table.num_configs:
+            value = 0
+        elif table.terminal(index):
+            value = 1
+        else:
+            value = expectation([get(next_index) for next_index in table.successor_indexes(index)])
+        table.put(index, value)
+        index = reached.rfind(1, 0, index)
+    return table[state]
+
+def backup(state, values=None):
+    # Value of a state whose successors are all solved, given the values of its
+    # successors in the order successors() returns them if they're already known.
+    # Uses the same order of operations as calculate_value so the iterative
+    # engines match it exactly.
+    if is_terminal(state):
+        return 0 if state[-1] == sun_len - 1 else 1
+    if values is None:
+        values = [memo[next_state] for next_state in successors(state)]
+    return expectation(values)
+
+def expectation(values):
+    # Value of a non-terminal state from the values of its successors, grouped like
+    # successors() returns them
+    moving = (len(values) - 1) // (len(cards) - 1)
+    win_prob = 0
+    k = 1
+    for card in cards[:-1]:
+        win_prob += card_probabilities[card] * max(values[k:k + moving])
+        k += moving
+    win_prob += card_probabilities["sun"] * values[0]
+    return win_prob
+
+def solve(state, engine):
+    # Populates the memo with the values of all states reachable from state
+    if engine == "iterative":
+        if isinstance(memo, ValueTable):
+            return solve_packed(state)
+        return solve_iterative(state)
+    return calculate_value(state)
+
+class PolicyTable:
+    # Best move for every solved state reachable from a start state and every hand,
+    # so playing a move is a single lookup instead of trying every card on every
+    # owl. Each state gets a row of moves, one byte per hand: SUN_MOVE if the hand
+    # has a sun card, and otherwise 1 + card * 6 + owl, where owl is the owl's
+    # position in the canonical (sorted) state. keys finds a state's row: a sorted
+    # array of table indexes for a ValueTable memo, and a dict from canonical
+    # states to rows for a dict memo.
+    SUN_MOVE = 255
+
+    def __init__(self, table, start=None, keys=None, moves=None):
+        self.table = table
+        if moves is None:
+            keys, moves = self.build(table, start)
+        self.keys = keys
+        self.moves = moves
+
+    @staticmethod
+    def build(table, start):
+        # Works out the best owl for each color card in every state reachable from
+        # start, then picks the best card for every hand. Which card wins for each
+        # hand only depends on how the cards rank, so the winning card of every
+        # hand is worked out once per ranking and turned into moves with
+        # bytes.translate. Ties go to the lowest card in card order and then to
+        # the owl furthest along, like get_best_action.
+        if isinstance(table, ValueTable):
+            reached = table.reachable(table.index(start), solved=True)
+            keys = array("q")
+            index = reached.find(1)
+            while index != -1:
+                if not table.terminal(index):
+                    keys.append(index)
+                index = reached.find(1, index + 1)
+            states = keys
+            get = table.get if table.readonly else table.values.__getitem__
+        else:
+            states = [state for state in table if not is_terminal(state)]
+            keys = {state: row for row, state in enumerate(states)}
+        moves = bytearray(len(states) * len(hands))
+        sun_card = len(cards) - 1
+        winners = {}
+        for row, state in enumerate(states):
+            if isinstance(table, ValueTable):
+                next_values = [get(next_index) for next_index in table.successor_indexes(state)]
+            else:
+                next_values = [table[next_state] for next_state in successors(state)]
+            # Successors of each card list the owls off the nest in canonical order,
+            # after the owls at the nest
+            moving = (len(next_values) - 1) // sun_card
+            at_nest = (table.num_owls if isinstance(table, ValueTable) else len(state) - 1) - moving
+            best_values = []
+            codes = bytearray(range(256))
+            for card in range(sun_card):
+                card_values = next_values[1 + card * moving:1 + (card + 1) * moving]
+                best_value = max(card_values)
+                codes[card] = 1 + card * 6 + at_nest + card_values.index(best_value)
+                best_values.append(best_value)
+            codes[sun_card] = PolicyTable.SUN_MOVE
+            ranking = tuple(sorted(range(sun_card), key=lambda card: (-best_values[card], card)))
+            if ranking not in winners:
+                rank = {card: ranking.index(card) for card in ranking}
+                rank[sun_card] = -1
+                winners[ranking] = bytes(min(hand, key=lambda card: rank[card]) for hand in hands)
+            moves[row * len(hands):(row + 1) * len(hands)] = winners[ranking].translate(codes)
+        return keys, moves
+
+    def save(self, path):
+        # Writes the policy in the same format as value tables, with its own magic:
+        # the number of states, then their indexes and their rows of moves
+        header = TABLE_HEADER.pack(POLICY_MAGIC, TABLE_VERSION, sys.byteorder[0].encode(), b"B",
+                                   self.table.num_owls, len(self.keys), len(self.table),
+                                   table_fingerprint())
+        with open(path, "wb") as f:
+            f.write(header.ljust(TABLE_DATA_OFFSET, b"\0"))
+            f.write(self.keys)
+            f.write(self.moves)
+
+    @classmethod
+    def load(cls, path, table):
+        # Memory-maps a saved policy for a value table. Raises ValueError like
+        # ValueTable.load, or if it doesn't match the value table.
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        typecode, num_owls, length, solved = read_table_header(mapped, path, POLICY_MAGIC, "policy table")
+        data = memoryview(mapped)[TABLE_DATA_OFFSET:]
+        key_size = length * array("q").itemsize
+        if num_owls != table.num_owls or len(data) != key_size + length * len(hands):
+            raise ValueError(path + " does not match the value table or is corrupt")
+        policy = cls(table, keys=data[:key_size].cast("q"), moves=data[key_size:])
+        policy.mapped = mapped
+        return policy
+
+    def row(self, state):
+        # Row of moves for a state, or None if the policy doesn't cover it
+        if isinstance(self.keys, dict):
+            return self.keys.get(canonical_state(state))
+        index = self.table.index(state)
+        row = bisect.bisect_left(self.keys, index)
+        if row < len(self.keys) and self.keys[row] == index:
+            return row
+        return None
+
+    def move(self, state, set_cards):
+        # Returns the (card, owl) to play from state with the cards, with owl
+        # counted in the state's own owl order, or None if the policy doesn't
+        # cover the state
+        row = self.row(state)
+        if row is None:
+            return None
+        hand = tuple(sorted(cards.index(card) for card in set_cards))
+        code = self.moves[row * len(hands) + hand_index[hand]]
+        if code == PolicyTable.SUN_MOVE:
+            return "sun", None
+        card, owl = divmod(code - 1, 6)
+        # Owls that aren't at the nest are on different squares, so the owl can be
+        # found by its square
+        square = sorted(state[:-1], reverse=True)[owl]
+        return cards[card], list(state[:-1]).index(square)
+
+# Policy table for the memo, if one was built with --policy
+policy = None
+
+def policy_action(state, set_cards):
+    # get_best_action using the policy table, falling back to get_best_action for
+    # states the policy doesn't cover
+    move = policy.move(state, set_cards)
+    if move is None:
+        return get_best_action(state, set_cards)
+    card, owl = move
+    if card == "sun":
+        new_state = list(state[:-1]) + [state[-1] + 1]
+    else:
+        new_state = list(move_owl(state, owl, card))
+    return memo[canonical_state(new_state)], card, owl, new_state
+
+# Composition of the real deck for the deck-aware solver
+deck = {
+    "blue": 6,
+    "purple": 6,
+    "red": 6,
+    "yellow": 6,
+    "green": 6,
+    "orange": 6,
+    "sun": 14
+}
+
+# Last square of each color, after which that color can only move an owl to the nest
+last_square = {card: max(j for j in range(board_len) if board[j] == card) for card in cards[:-1]}
+
+# Deck-aware solver. Instead of drawing from card_probabilities, each turn draws a
+# card from what's left of the deck, so the remaining deck is part of the state.
+# remaining is the number of each card left in the deck at the start state, in card
+# order. By default the deck is full apart from the sun cards already played, which
+# only matches a real game at the start. Suns are only ever drawn to move the sun, so
+# the number left always follows from the sun position. Hands aren't modelled, so
+# every card not yet played counts as still in the deck.
+#
+# A state is the packed ValueTable index of its owls and sun combined with a deck
+# code. Every move increases the index, so states are solved in decreasing order of
+# their keys like in solve_packed, and only states reachable from the start state
+# are expanded.
+#
+# With aggregate="colors" the deck code holds the count of every color, packed with
+# a digit per color. Colors whose last square is behind every owl not yet at the
+# nest (dead colors) can only move an owl straight to the nest, and since owls
+# never move backwards they stay that way. Drawing any dead color does the same
+# thing, so only how many dead color cards are left matters, and they're pooled
+# into one extra digit. This is exact, but every color has squares ahead of the back
+# owl until it is past square 33, so with a full deck the number of deck states
+# grows quickly and it is only practical close to the end of the game, or with the
+# real, smaller deck of a game in progress.
+#
+# With aggregate="totals" the deck code is only the number of color cards left, and
+# all deck states with the same total are merged by treating the colors as being
+# drawn evenly. This is an approximation that keeps the sun cards exact but doesn't
+# count the colors at all. It is small enough to keep in arrays over the keys and
+# solve from the start state for 3 owls.
+def solve_deck(state, aggregate="colors", remaining=None):
+    table = ValueTable(len(state) - 1)
+    colors = cards[:-1]
+    start = canonical_state(state)
+    if remaining is None:
+        remaining = [deck[card] for card in colors] + [deck["sun"] - start[-1]]
+    # Number of suns left in the deck is suns_at_start minus the sun position
+    suns_at_start = remaining[-1] + start[-1]
+    num_colors = sum(remaining[:-1])
+    base = max(remaining[:-1]) + 1
+    place = [base ** c for c in range(len(colors))]
+    pool_place = base ** len(colors)
+    if aggregate == "totals":
+        num_codes = num_colors + 1
+    else:
+        num_codes = pool_place * (num_colors + 1)
+    # Bitmask of the dead colors of each configuration, worked out when first needed
+    dead_masks = array("b", [-1]) * table.num_configs
+
+    def dead(index):
+        rank = index % table.num_configs
+        mask = dead_masks[rank]
+        if mask == -1:
+            owls = table.squares(rank)
+            back = owls[-1] if owls else board_len - 1
+            mask = sum(1 << c for c in range(len(colors)) if last_square[colors[c]] <= back)
+            dead_masks[rank] = mask
+        return mask
+
+    def key(index, code, mask):
+        # Key of the state at index with the deck code of its parent, whose dead
+        # colors are mask. Colors that have just died are moved into the pool.
+        new_mask = dead(index)
+        if new_mask != mask:
+            for c in range(len(colors)):
+                if new_mask >> c & 1 and not mask >> c & 1:
+                    code += code // place[c] % base * (pool_place - place[c])
+        return index * num_codes + code
+
+    def deck_moves(current_key):
+        # Returns (number of cards, successor keys) for every card left in the deck,
+        # or nothing for a terminal state
+        index, code = divmod(current_key, num_codes)
+        if table.terminal(index):
+            return []
+        next_indexes = table.successor_indexes(index)
+        moving = (len(next_indexes) - 1) // len(colors)
+        moves = []
+        suns = suns_at_start - index // table.num_configs
+        if suns > 0:
+            # The owls don't move, so the deck code is already merged
+            moves.append((suns, [next_indexes[0] * num_codes + code]))
+        if aggregate == "totals":
+            if code:
+                for c in range(len(colors)):
+                    group = next_indexes[1 + c * moving:1 + (c + 1) * moving]
+                    moves.append((code / len(colors), [n * num_codes + code - 1 for n in group]))
+            return moves
+        mask = dead(index)
+        pool = code // pool_place
+        for c in range(len(colors)):
+            group = next_indexes[1 + c * moving:1 + (c + 1) * moving]
+            if mask >> c & 1:
+                # Every dead color moves the owl we pick to the nest, so the first
+                # one stands in for all of them
+                if pool:
+                    moves.append((pool, [key(n, code - pool_place, mask) for n in group]))
+                    pool = 0
+            elif code // place[c] % base:
+                moves.append((code // place[c] % base, [key(n, code - place[c], mask) for n in group]))
+        return moves
+
+    def value(current_key, moves, get):
+        if not moves:
+            return 0 if current_key // num_codes >= (sun_len - 1) * table.num_configs else 1
+        total = sum(count for count, next_keys in moves)
+        win_prob = 0
+        for count, next_keys in moves:
+            win_prob += count / total * max(get(next_key) for next_key in next_keys)
+        return win_prob
+
+    if aggregate == "totals":
+        start_key = table.index(start) * num_codes + num_colors
+        # Mark the reachable keys on a forward pass and solve them on a backward
+        # pass, like solve_packed
+        reached = bytearray(len(table.values) * num_codes)
+        values = array("d", [0.0]) * len(reached)
+        reached[start_key] = 1
+        current_key = start_key
+        while current_key != -1:
+            for count, next_keys in deck_moves(current_key):
+                for next_key in next_keys:
+                    reached[next_key] = 1
+            current_key = reached.find(1, current_key + 1)
+        current_key = reached.rfind(1)
+        while current_key != -1:
+            values[current_key] = value(current_key, deck_moves(current_key), values.__getitem__)
+            current_key = reached.rfind(1, 0, current_key)
+        return values[start_key], reached.count(1)
+
+    # The keys of the exact model are too sparse for arrays, so states are solved
+    # depth first into a dict. Each state's moves are kept until all its successors
+    # are solved, which only holds the states along the current path.
+    start_key = key(table.index(start), sum(remaining[c] * place[c] for c in range(len(colors))), 0)
+    values = {}
+    expanded = {}
+    stack = [start_key]
+    while stack:
+        current_key = stack[-1]
+        if current_key in values:
+            stack.pop()
+        elif current_key in expanded:
+            values[current_key] = value(current_key, expanded.pop(current_key), values.__getitem__)
+            stack.pop()
+        else:
+            moves = deck_moves(current_key)
+            expanded[current_key] = moves
+            for count, next_keys in moves:
+                for next_key in next_keys:
+                    if next_key not in values:
+                        stack.append(next_key)
+    return values[start_key], len(values)
+
 def get_best_action(state, set_cards):
-    # Returns the best action we can take given the current state and the cards
+    # Returns the best action we can take given the current state and the cards.
+    # If we have a sun card it's the only move, since we have to play it.
     best_action = None
-    best_prob = None
+    best_order = None
     best_owl = None
 
-    # Have to play sun card if we have it
-    if "sun" in set_cards:
-        next_sun = state[-1] + 1
-        new_state = list(state[:-1] + [next_sun])
+    # Pick best action out of all our cards
+    for move in legal_moves(state, set_cards):
+        card, i, next_pos = move
+        new_state = list(successor(state, move))
         action_value = calculate_value(new_state)
-        if best_prob is None or action_value > best_prob:
-            best_prob = action_value
-            best_action = "sun"
-            best_owl = None
+        # If this action is better than the best action we've seen so far,
+        # update the best action. Ties go to the lowest card in card order and
+        # then to the owl furthest along, whatever order the hand and owls are
+        # in, so the policy table picks the same moves.
+        order = (action_value, -card_rank[card], state[i] if i is not None else 0)
+        if best_order is None or order > best_order:
+            best_order = order
+            best_action = card
+            best_owl = i
             best_state = new_state
-        return best_prob, best_action, best_owl, best_state
+    return best_order[0], best_action, best_owl, best_state
 
-    # Pick best action out of all our cards
-    for card in set_cards:
-        owls = state[:-1]
-        for i in range(len(state) - 1):
-            if state[i] == board_len - 1:
-                continue
-            for j in range(state[i] + 1, board_len):
-                if board[j] == "nest":
-                    next_pos = j
-                    break
-                elif board[j] == card and j not in owls:
-                    next_pos = j
-                    break
-            new_state = list(state)
-            new_state[i] = next_pos
-            action_value = calculate_value(new_state)
-            # If this action is better than the best action we've seen so far,
-            # update the best action
-            if best_prob is None or action_value > best_prob:
-                best_prob = action_value
-                best_action = card
-                best_owl = i
-                best_state = new_state
-    return best_prob, best_action, best_owl, best_state
+
+def play_games(start_state, num_games, rng=random):
+    # Simulate running the game num_games times, choosing best action every time,
+    # and return the number of games won
+    return simulate_games(get_best_action, start_state, num_games, rng)
     
 
+def load_policy(options, state):
+    # Sets up the policy table for --policy once the memo is solved from state. A
+    # policy saved next to a loaded value table (with .policy added to its name)
+    # is reused, otherwise the policy is built from the memo.
+    global policy
+    path = options.get("load-table")
+    if path and os.path.exists(path + ".policy"):
+        try:
+            policy = PolicyTable.load(path + ".policy", memo)
+            return
+        except (OSError, ValueError) as e:
+            print("Could not load policy table: " + str(e))
+            exit(1)
+    policy = PolicyTable(memo, state)
+
+
+def enable_stats(option):
+    # Instruments the solver for --stats. Every call to calculate_value counts as a
+    # memo hit or miss, and solving, move generation, best action queries and
+    # games are timed. Returns False if the option isn't valid.
+    global calculate_value
+    import stats
+    value = calculate_value
+
+    def counted_value(state):
+        stats.count("memo hits" if canonical_state(state) in memo else "memo misses")
+        return value(state)
+
+    def gauges():
+        sizes = {"states solved": len(memo)}
+        if isinstance(memo, ValueTable):
+            sizes["table entries"] = len(memo.values)
+        return sizes
+
+    calculate_value = counted_value
+    stats.instrument(sys.modules[__name__], ["solve", "backup", "successors", "next_position",
+                                             "get_best_action", "play_games"])
+    return stats.enable(option, gauges)
+
+
 def main():
+    global memo
+    args, options = parse_options(sys.argv[1:])
+    if "stats" in options and not enable_stats(options["stats"]):
+        print("Invalid stats format inputted. Please input --stats or --stats=json.")
+        exit(1)
     # Check command-line arguments
-    if len(sys.argv) != 2 and len(sys.argv) != 3:
+    if (len(args) != 1 and len(args) != 2) and "batch" not in options:
         print("Usage: ./DP <state> or ./DP <state> <num_games> or ./DP <state> <card1,card2,card3>")
+        print("       ./DP --batch=<file>")
+        print("Options: --engine=recursive|iterative --table=dict|packed|packed32 " +
+              "--save-table=<file> --load-table=<file> --vectorized --workers=<n> --seed=<n> " +
+              "--deck=colors|totals --remaining=<counts> --policy --sweep=<file> --trace=<file> --stats[=json]")
         exit(0)
 
-    state = sys.argv[1]
-    state = state.split(",")
-    state = [int(x) for x in state]
-
-    # Error checking
-    owl_pos = state[:-1]
-    sun_pos = state[-1]
-    if sun_pos < 0 or sun_pos >= sun_len:
-        print("Invalid sun position inputted. Sun position should be between 0 and 13.")
+    engine = options.get("engine", "recursive")
+    if engine not in ("recursive", "iterative"):
+        print("Invalid engine inputted. Please input 'recursive' or 'iterative'.")
+        exit(1)
+    table = options.get("table", "dict")
+    if table not in ("dict", "packed", "packed32"):
+        print("Invalid table inputted. Please input 'dict', 'packed' or 'packed32'.")
         exit(1)
-    for pos in owl_pos:
-        if pos < 0 or pos >= board_len:
-            print("Invalid owl position inputted. Owl positions should be between 0 and 39.")
+
+    if "load-table" in options:
+        # Reuse a table solved by an earlier run instead of solving from scratch
+        try:
+            memo = ValueTable.load(options["load-table"])
+        except (OSError, ValueError) as e:
+            print("Could not load value table: " + str(e))
             exit(1)
-        # Check if two owl positions are the same
-        if owl_pos.count(pos) > 1 and pos != 39:
-            print("Invalid owl positions inputted. Owl positions should be unique.")
+
+    if "batch" in options:
+        # Answer every query in the file with the same memo, so states solved for
+        # one query are reused by the rest
+        def batch_action(state, set_cards):
+            global memo
+            if table != "dict" and not isinstance(memo, ValueTable):
+                memo = ValueTable(len(state) - 1, "f" if table == "packed32" else "d")
+            if isinstance(memo, ValueTable) and memo.num_owls != len(state) - 1:
+                raise ValueError("Value table was solved for " + str(memo.num_owls) + " owls, not " +
+                                 str(len(state) - 1) + ".")
+            solve(state, engine)
+            return get_best_action(state, set_cards)
+        run_batch(options["batch"], batch_action)
+        if "save-table" in options and isinstance(memo, ValueTable):
+            memo.save(options["save-table"])
+        return
+
+    state = parse_state(args[0])
+
+    if "load-table" in options:
+        if memo.num_owls != len(state) - 1:
+            print("Value table was solved for " + str(memo.num_owls) + " owls, not " +
+                  str(len(state) - 1) + ".")
             exit(1)
-    if len(state) < 4 or len(state) > 7:
-        print("Invalid state inputted. States should consist of 3-6 owl positions and the sun position.")
-        exit(1)
+    elif table != "dict" or "save-table" in options or "vectorized" in options or "workers" in options:
+        memo = ValueTable(len(state) - 1, "f" if table == "packed32" else "d")
 
     # Evaluation
-    if len(sys.argv) == 3 and sys.argv[2].isdigit():
-        num_games = int(sys.argv[2])
-        # Simulate running the game num_games times, choosing best action every time
-        # and outputting the average win probability
-        wins = 0
-        start_state = state
-        for _ in range(num_games):
-            # Always start from beginning
-            probabilities = [0.12, 0.12, 0.12, 0.12, 0.12, 0.12, 0.28]
-            state = start_state
-            # Pick 3 random cards
-            random_cards = random.choices(cards, probabilities, k=3)
-            while not is_terminal(state):
-                best_prob, best_action, best_owl, best_state = get_best_action(state, random_cards)
-                state = best_state
-                # Remove the card we played from our set and add a new random card
-                random_cards.remove(best_action)
-                random_cards.append(random.choices(cards, probabilities)[0])
-            if state[-1] == sun_len - 1:
-                wins += 0
+    if len(args) == 2 and args[1].isdigit():
+        num_games = int(args[1])
+        workers, seed = worker_options(options)
+        trace = trace_option(options)
+        if "vectorized" in options:
+            # The vectorized DP policy reads values straight out of the packed table
+            solve(state, "iterative")
+            # NumPy is only needed for the vectorized simulator
+            import batch_sim
+            batch_policy = batch_sim.dp_policy(memo)
+            play = lambda n, seed: batch_sim.simulate(batch_policy, state, n, card_weights, seed)
+        else:
+            # Solve before starting any workers so they all share the same table
+            # instead of each solving it again
+            if engine == "iterative" or workers > 1 or "policy" in options:
+                solve(state, engine)
+            if "policy" in options:
+                # Every move is a lookup in the policy table
+                load_policy(options, state)
+                play = lambda n, seed: simulate_games(policy_action, state, n, random.Random(seed))
             else:
-                wins += 1
+                play = lambda n, seed: play_games(state, n, random.Random(seed))
+        wins = run_games(play, num_games, workers, seed, trace)
         print("Average Win Percentage: " + str(wins / num_games * 100) + "%")
+        if "vectorized" in options:
+            print("95% confidence interval: +/- " + str(batch_sim.confidence_interval(wins, num_games)) + "%")
         return
     
 
+    if "deck" in options:
+        # Compare the uniform card probabilities with drawing from the real deck
+        aggregate = "colors" if options["deck"] is True else options["deck"]
+        if len(args) != 1 or aggregate not in ("colors", "totals"):
+            print("Usage: ./DP <state> --deck or ./DP <state> --deck=totals")
+            exit(1)
+        remaining = None
+        if "remaining" in options:
+            # Cards left in the deck of a game in progress, in card order
+            try:
+                remaining = [int(x) for x in str(options["remaining"]).split(",")]
+            except ValueError:
+                remaining = []
+            if len(remaining) != len(cards) or min(remaining) < 0:
+                print("Invalid deck inputted. Please input the number of " + ", ".join(cards) +
+                      " cards left in the deck.")
+                exit(1)
+            # Hands aren't modelled, so the deck has to hold every sun card still
+            # to be played
+            if remaining[-1] < sun_len - 1 - state[-1]:
+                print("The deck needs at least " + str(sun_len - 1 - state[-1]) + " sun cards left.")
+                exit(1)
+        start_time = time.time()
+        win_prob = solve(state, engine)
+        print("Uniform model: win probability " + str(win_prob) + " (" + str(len(memo)) +
+              " states solved in " + str(round(time.time() - start_time, 2)) + " seconds)")
+        start_time = time.time()
+        win_prob, num_states = solve_deck(state, aggregate, remaining)
+        label = "exact" if aggregate == "colors" else "approximate, colors drawn evenly"
+        print("Deck-aware model (" + label + "): win probability " + str(win_prob) + " (" +
+              str(num_states) + " states solved in " + str(round(time.time() - start_time, 2)) +
+              " seconds)")
+        return
+
+    if "sweep" in options:
+        # Solve once for every card probability scenario in the file
+        if len(args) != 1 or options["sweep"] is True:
+            print("Usage: ./DP <state> --sweep=<file>")
+            exit(1)
+        # NumPy is only needed for the sweep
+        import sweep
+        try:
+            names, probabilities = sweep.read_scenarios(options["sweep"])
+        except (OSError, ValueError) as e:
+            print("Could not read scenarios: " + str(e))
+            exit(1)
+        start_time = time.time()
+        win_probs = sweep.solve(state, probabilities)
+        print("scenario," + ",".join(cards) + ",win_probability")
+        for name, row, win_prob in zip(names, probabilities, win_probs):
+            print(name + "," + ",".join(str(round(p, 4)) for p in row) + "," + str(win_prob))
+        print("Solved " + str(len(names)) + " scenarios in " + str(round(time.time() - start_time, 2)) +
+              " seconds", file=sys.stderr)
+        return
+
     # Populates the memo with values of states
-    calculate_value(state)
+    solve(state, engine)
+    if "policy" in options:
+        load_policy(options, state)
+    if "save-table" in options:
+        memo.save(options["save-table"])
+        print("Saved value table to " + options["save-table"])
+        if "policy" in options:
+            policy.save(options["save-table"] + ".policy")
+            print("Saved policy table to " + options["save-table"] + ".policy")
 
-    if len(sys.argv) == 2:
-        print("The probability of winning from this state is " + str(memo[tuple(state)]))
+    if len(args) == 1:
+        print("The probability of winning from this state is " + str(memo[canonical_state(state)]))
     else:
-        set_cards = sys.argv[2]
-        set_cards = set_cards.split(",")
-        if len(set_cards) != 3:
-            print("Invalid number of cards inputted. Please input 3 cards.")
-            exit(1)
-        for card in set_cards:
-            if card not in cards:
-                print("Invalid card inputted. Please input a valid card.")
-                exit(1)
+        set_cards = parse_cards(args[1])
         if is_terminal(state):
             print("Inputted state is terminal; no action possible")
             exit(0)
         if "sun" in set_cards:
             print("Sun card in hand; you must play it")
             exit(0)
-        best_prob, best_action, best_owl, best_state = get_best_action(state, set_cards)
+        if "policy" in options:
+            best_prob, best_action, best_owl, best_state = policy_action(state, set_cards)
+        else:
+            best_prob, best_action, best_owl, best_state = get_best_action(state, set_cards)
         print("Best action to take is to move owl " + str(best_owl + 1) + 
               " using card " + best_action + ", resulting in position " + 
               str(best_state) + " with win probability " + str(best_prob))
@@ -0,0 +1,394 @@
+# Shared game rules, move generation and helpers for the Hoot Owl Hoot agents
+import sys
+import csv
+import json
+import math
+import random
+import itertools
+import multiprocessing
+from array import array
+
+# Taken from a real photo of the game board starting from 3rd owl position.
+# Colors: blue, purple, red, yellow, green, orange
+# nest is the end of the game
+board = ["yellow", "green", "orange", "blue", "purple", "red", "blue", "purple", 
+         "red", "yellow", "green", "blue", "orange", "red", "purple", "yellow", 
+         "green", "orange", "blue", "purple", "red", "green", "yellow", "orange", 
+         "blue", "purple", "red", "yellow", "green", "blue", "orange", "red", 
+         "purple", "yellow", "green", "blue", "orange", "red", "purple", "nest"]
+
+
+cards = ["blue", "purple", "red", "yellow", "green", "orange", "sun"]
+
+board_len = len(board)
+sun_len = 14
+nest = board_len - 1
+
+# next_square[card][pos] is the first square after pos with the card's color, or
+# the nest if there are none left. Owls at the nest stay at the nest.
+next_square = {}
+for card in cards[:-1]:
+    next_square[card] = [nest] * board_len
+    for pos in range(board_len - 2, -1, -1):
+        if board[pos + 1] == card:
+            next_square[card][pos] = pos + 1
+        else:
+            next_square[card][pos] = next_square[card][pos + 1]
+
+def next_position(state, i, card):
+    # Returns the square owl i moves to when playing a color card: the next square
+    # of that color that no other owl is on, or the nest. Occupied squares are
+    # skipped by jumping straight to the following square of the same color.
+    owls = state[:-1]
+    squares = next_square[card]
+    pos = squares[state[i]]
+    while pos != nest and pos in owls:
+        pos = squares[pos]
+    return pos
+
+# Uniform probability distribution based on real deck.
+# Six cards of each color and 14 sun cards.
+card_probabilities = {
+    "blue": 0.12,
+    "purple": 0.12,
+    "red": 0.12,
+    "yellow": 0.12,
+    "green": 0.12,
+    "orange": 0.12,
+    "sun": 0.28
+}
+
+# Card probabilities in the same order as cards, for drawing with choices
+card_weights = [card_probabilities[card] for card in cards]
+
+def is_terminal(state):
+    # Checks that either the sun has reached the end or all owls are at the end
+    return state[-1] == sun_len - 1 or all([pos == nest for pos in state[:-1]])
+
+def legal_moves(state, hand):
+    # Returns every move (card, owl, next position) we can make with the cards in
+    # hand. A sun card has to be played if we have one, so then the sun move
+    # ("sun", None, None) is the only move. Owls at the nest can't move.
+    if "sun" in hand:
+        return [("sun", None, None)]
+    moves = []
+    for card in hand:
+        for i in range(len(state) - 1):
+            if state[i] != nest:
+                moves.append((card, i, next_position(state, i, card)))
+    return moves
+
+def successor(state, move):
+    # Returns the state after making a move from legal_moves as a tuple
+    new_state = list(state)
+    if move[0] == "sun":
+        new_state[-1] += 1
+    else:
+        new_state[move[1]] = move[2]
+    return tuple(new_state)
+
+# traces.TraceWriter the game loops record moves with, or None when games aren't
+# traced
+tracer = None
+
+def simulate_games(get_best_action, start_state, num_games, rng=random):
+    # Simulate running the game num_games times and return the number of games won.
+    # get_best_action(state, cards) picks every move and returns its value, card,
+    # owl and resulting state like the agents' get_best_action functions.
+    wins = 0
+    for _ in range(num_games):
+        # Always start from beginning
+        state = start_state
+        # Pick 3 random cards
+        random_cards = rng.choices(cards, card_weights, k=3)
+        while not is_terminal(state):
+            best_value, best_action, best_owl, best_state = get_best_action(state, random_cards)
+            if tracer is not None:
+                tracer.record(state, random_cards, best_action, best_owl)
+            state = best_state
+            # Remove the card we played from our set and add a new random card
+            random_cards.remove(best_action)
+            random_cards.append(rng.choices(cards, card_weights)[0])
+        if tracer is not None:
+            tracer.end_game(state)
+        if state[-1] != sun_len - 1:
+            wins += 1
+    return wins
+
+# Every hand of 3 cards as a sorted tuple of card indexes (84 of them), and the
+# position of each hand in that list
+hands = list(itertools.combinations_with_replacement(range(len(cards)), 3))
+hand_index = {hand: h for h, hand in enumerate(hands)}
+
+def evaluate_policy(policy, start_state):
+    # Exact win probability of a fixed policy from start_state with a random starting
+    # hand, which is what the average win percentage of simulate_games tends to
+    # with more and more games. policy(state, cards) returns every move the policy
+    # can make as (probability, card, resulting state), so a policy that picks its
+    # move at random is handled in expectation. Returns the win probability and the
+    # number of states evaluated.
+    #
+    # This is the same memoized recursion over states as calculate_value in
+    # dp_agent.py, except a state's value also depends on the hand. The played card
+    # is replaced by a random one, so for every state the memo holds the chance of
+    # winning when holding each pair of cards, just before drawing the third.
+    #
+    # States are passed to the policy with the owls in canonical order (furthest
+    # ahead first) and hands in card order, so the policy has to make the same
+    # choice whatever order the owls and cards are in, like simulated games assume.
+    arrange = lambda hand: tuple(sorted(hand))
+    hand_list = hands
+    pair_list = list(itertools.combinations_with_replacement(range(len(cards)), 2))
+    hand_position = {hand: h for h, hand in enumerate(hand_list)}
+    pair_position = {pair: p for p, pair in enumerate(pair_list)}
+    hand_cards = [[cards[card] for card in hand] for hand in hand_list]
+    # Pair of cards kept after playing each card from each hand (the first copy of
+    # it, like simulate_games), and the probability and resulting hand of every
+    # card we can draw with each pair
+    kept_pairs = [{cards[card]: pair_position[hand[:k] + hand[k + 1:]] for k, card in reversed(list(enumerate(hand)))}
+                  for hand in hand_list]
+    draws = [[(card_weights[card], hand_position[arrange(pair + (card,))]) for card in range(len(cards))]
+             for pair in pair_list]
+    memo = {}
+    sun_card = len(cards) - 1
+
+    def kept_values(state):
+        key = tuple(sorted(state[:-1], reverse=True)) + (state[-1],)
+        if key in memo:
+            return memo[key]
+        if is_terminal(key):
+            memo[key] = array("d", [0.0 if key[-1] == sun_len - 1 else 1.0]) * len(pair_list)
+            return memo[key]
+        # Sun cards have to be played, so that's up to the rules, not the policy.
+        # The policy is asked about every other hand before looking any further.
+        sun_moves = [(1, "sun", successor(key, ("sun", None, None)))]
+        hand_moves = [sun_moves if sun_card in hand else policy(list(key), hand_cards[h])
+                      for h, hand in enumerate(hand_list)]
+        # Most hands lead to the same few states, so each one is only looked up once
+        next_values = {}
+        hand_values = []
+        for h, moves in enumerate(hand_moves):
+            value = 0
+            for probability, card, new_state in moves:
+                new_state = tuple(new_state)
+                if new_state not in next_values:
+                    next_values[new_state] = kept_values(new_state)
+                value += probability * next_values[new_state][kept_pairs[h][card]]
+            hand_values.append(value)
+        memo[key] = array("d", [sum(weight * hand_values[h] for weight, h in hand_draws) for hand_draws in draws])
+        return memo[key]
+
+    # The starting hand is two random cards kept plus a third drawn like any other
+    start_values = kept_values(start_state)
+    win_prob = 0
+    for first in range(len(cards)):
+        for second in range(len(cards)):
+            win_prob += card_weights[first] * card_weights[second] * start_values[pair_position[arrange((first, second))]]
+    return win_prob, len(memo)
+
+def state_error(state):
+    # Returns why a state isn't valid, or None if it is
+    owl_pos = state[:-1]
+    sun_pos = state[-1]
+    if sun_pos < 0 or sun_pos >= sun_len:
+        return "Invalid sun position inputted. Sun position should be between 0 and 13."
+    for pos in owl_pos:
+        if pos < 0 or pos >= board_len:
+            return "Invalid owl position inputted. Owl positions should be between 0 and 39."
+        # Check if two owl positions are the same
+        if owl_pos.count(pos) > 1 and pos != nest:
+            return "Invalid owl positions inputted. Owl positions should be unique."
+    if len(state) < 4 or len(state) > 7:
+        return "Invalid state inputted. States should consist of 3-6 owl positions and the sun position."
+    return None
+
+def cards_error(set_cards):
+    # Returns why a hand of cards isn't valid, or None if it is
+    if len(set_cards) != 3:
+        return "Invalid number of cards inputted. Please input 3 cards."
+    for card in set_cards:
+        if card not in cards:
+            return "Invalid card inputted. Please input a valid card."
+    return None
+
+def parse_state(text):
+    # Reads a state from the command line, exiting with an error if it isn't valid
+    try:
+        state = [int(x) for x in text.split(",")]
+    except ValueError:
+        print("Invalid state inputted. States should be comma-separated numbers.")
+        exit(1)
+    error = state_error(state)
+    if error:
+        print(error)
+        exit(1)
+    return state
+
+def parse_cards(text):
+    # Reads a hand of 3 cards from the command line, exiting with an error if it
+    # isn't valid
+    set_cards = text.split(",")
+    error = cards_error(set_cards)
+    if error:
+        print(error)
+        exit(1)
+    return set_cards
+
+def answer_query(state, set_cards, get_best_action):
+    # Answers a single query with get_best_action(state, cards). Returns the error
+    # if the query isn't valid or get_best_action raised a ValueError, otherwise its
+    # value, card, owl (counting from 1) and resulting state.
+    if not isinstance(state, list) or len(state) < 2 or not all(isinstance(x, int) for x in state):
+        return ("Invalid state inputted. States should be lists of owl positions and the sun position.",)
+    if not isinstance(set_cards, list):
+        return ("Invalid cards inputted. Please input a list of 3 cards.",)
+    error = state_error(state) or cards_error(set_cards)
+    if error:
+        return (error,)
+    if is_terminal(state):
+        return ("Inputted state is terminal; no action possible",)
+    try:
+        value, card, owl, new_state = get_best_action(state, set_cards)
+    except ValueError as e:
+        return (str(e),)
+    # Greedy and rule-based agents have no value for a sun move
+    if value is not None and not math.isfinite(value):
+        value = None
+    return None, value, card, None if owl is None else owl + 1, list(new_state)
+
+def run_batch(path, get_best_action):
+    # Answers every query in a file (or stdin if path is "-") and writes one result
+    # line per query as soon as it's answered, so memory use doesn't grow with the
+    # number of queries. A query is either a JSON object with "state" and "cards"
+    # lists (and an optional "id" that's copied to its result), answered with a JSON
+    # object with the card, owl, resulting state and value, or a CSV row of the state
+    # followed by the cards, answered with a card,owl,value,state... row. Invalid
+    # queries get an "error" instead. Returns the number of queries answered.
+    source = sys.stdin if path == "-" else open(path)
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    count = 0
+    for line in source:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                query = json.loads(line)
+                result = answer_query(query.get("state"), query.get("cards"), get_best_action)
+            except (ValueError, AttributeError):
+                query = {}
+                result = ("Invalid query inputted. Queries should be JSON objects.",)
+            if result[0] is None:
+                response = {"card": result[2], "owl": result[3], "state": result[4], "value": result[1]}
+            else:
+                response = {"error": result[0]}
+            if "id" in query:
+                response["id"] = query["id"]
+            sys.stdout.write(json.dumps(response) + "\n")
+        else:
+            fields = next(csv.reader([line]))
+            # Skip a header row
+            if not fields[0].strip().isdigit() and count == 0:
+                continue
+            numbers = [field.strip() for field in fields if field.strip().isdigit()]
+            set_cards = [field.strip() for field in fields if not field.strip().isdigit()]
+            result = answer_query([int(x) for x in numbers], set_cards, get_best_action)
+            if result[0] is None:
+                writer.writerow([result[2], result[3] if result[3] is not None else "", result[1]] + result[4])
+            else:
+                writer.writerow(["error", result[0]])
+        count += 1
+    if source is not sys.stdin:
+        source.close()
+    sys.stdout.flush()
+    return count
+
+def parse_options(argv):
+    # Splits --name=value options out of the command-line arguments
+    args = []
+    options = {}
+    for arg in argv:
+        if arg.startswith("--"):
+            name, _, value = arg[2:].partition("=")
+            options[name] = value if value else True
+        else:
+            args.append(arg)
+    return args, options
+
+# Function run by run_parallel in worker processes. It is set before the pool is
+# created so forked workers inherit it, along with anything it refers to, such as
+# an already solved value table.
+worker_task = None
+
+def run_worker(*args):
+    # With --stats, the worker's own counters and timers are sent back along with
+    # the result
+    stats = sys.modules.get("stats")
+    if stats is None or not stats.enabled:
+        return worker_task(*args), None
+    start_gauges = stats.start_worker()
+    result = worker_task(*args)
+    return result, stats.worker_totals(start_gauges)
+
+def run_parallel(task, jobs):
+    # Runs task(*job) for every job, each in its own worker process, and returns the
+    # results in the same order as the jobs
+    global worker_task
+    if len(jobs) == 1:
+        return [task(*jobs[0])]
+    worker_task = task
+    with multiprocessing.get_context("fork").Pool(len(jobs)) as pool:
+        results = pool.starmap(run_worker, jobs)
+    for result, totals in results:
+        if totals is not None:
+            sys.modules["stats"].merge(totals)
+    return [result for result, totals in results]
+
+def worker_seeds(seed, workers):
+    # Derives a seed for every worker from a single seed, or None for all of them
+    # if no seed was given so each worker seeds itself randomly
+    seeder = random.Random(seed)
+    return [seeder.getrandbits(64) if seed is not None else None for _ in range(workers)]
+
+def run_games(play, num_games, workers=1, seed=None, trace=None):
+    # Splits num_games across a pool of worker processes and returns the total
+    # number of wins. play(num_games, seed) plays games with its own random number
+    # generator. Worker seeds are all derived from seed, so the result is the same
+    # every time for a given seed and number of workers. With a trace path, every
+    # move is recorded to it. Each worker writes its own part with its own game
+    # numbers, and the parts are joined once they're all done.
+    shares = [num_games // workers + (k < num_games % workers) for k in range(workers)]
+    jobs = list(zip(shares, worker_seeds(seed, workers)))
+    if trace is None:
+        return sum(run_parallel(play, jobs))
+    # Only imported when games are traced
+    import traces
+    parts = [trace] if workers == 1 else [trace + "." + str(k) for k in range(workers)]
+
+    def traced_play(num_games, seed, k):
+        global tracer
+        tracer = traces.TraceWriter(parts[k], sum(shares[:k]))
+        try:
+            return play(num_games, seed)
+        finally:
+            tracer.close()
+            tracer = None
+
+    wins = sum(run_parallel(traced_play, [job + (k,) for k, job in enumerate(jobs)]))
+    if workers > 1:
+        traces.join(trace, parts)
+    return wins
+
+def worker_options(options):
+    # Reads --workers and --seed for the num_games mode
+    workers = options.get("workers", "1")
+    seed = options.get("seed")
+    if workers is True or not workers.isdigit() or int(workers) < 1:
+        print("Invalid number of workers inputted. Please input a positive integer.")
+        exit(1)
+    if seed is not None:
+        if seed is True or not seed.isdigit():
+            print("Invalid seed inputted. Please input a non-negative integer.")
+            exit(1)
+        seed = int(seed)
+    return int(workers), seed
@@ -0,0 +1,490 @@
+# Depth-limited Expectimax Agent for Hoot Owl Hoot
+# Looks a fixed number of card draws ahead, like the DP agent but without solving
+# every state to the end of the game, so it stays practical with 5 or 6 owls.
+# States at the depth limit get a quick estimate of their win probability from the
+# owls' progress against the sun steps left, kept below a quick upper bound on
+# the real win probability. Chance nodes are pruned with Star1: a chance
+# node stops as soon as the bounds on its remaining cards show its value can't
+# come back into the window, and owl moves that can't beat the best move already
+# found for a card are skipped. The upper bounds that make this work come from
+# how far the owls can get in the cards left to draw before the depth limit.
+import sys
+import math
+import time
+import random
+from engine import board, cards, board_len, nest, sun_len, next_square, card_probabilities, is_terminal
+from engine import legal_moves, successor, simulate_games, parse_state, parse_cards, parse_options
+from engine import run_games, worker_options, run_batch
+from traces import trace_option
+
+# Upper bounds on the win probability of a state that are known without searching
+# it. They keep the estimate at the search's leaves within reach of the real value.
+#
+# Every turn draws one card, so a game that needs at least (or at most) need more
+# moves can only be won (or is always won) if need color cards are drawn before
+# the sun reaches the end of its track. win_chance[suns][need] is the probability
+# of drawing need color cards before suns sun cards (a negative binomial tail).
+max_moves = 6 * (board_len - 1)
+win_chance = [[1.0] + [0.0] * max_moves]
+for suns in range(1, sun_len):
+    chances = [1.0]
+    lose = 0.0
+    for need in range(1, max_moves + 1):
+        # Lost if exactly need - 1 color cards come before the last sun card
+        lose += (math.comb(need + suns - 2, need - 1) * (1 - card_probabilities["sun"]) ** (need - 1) *
+                 card_probabilities["sun"] ** suns)
+        chances.append(max(0.0, 1 - lose))
+    win_chance.append(chances)
+
+# With n owls, a move can skip past at most n - 1 other owls, so an owl can land up
+# to n squares of the card's color ahead. fewest_jumps[n][pos] is the fewest moves
+# an owl at pos needs to reach the nest, and owl_chance[n][sun][pos] is the chance
+# that an owl at pos reaches the nest if it could use every color card drawn. The
+# game can't be won unless every owl reaches the nest, so both bound its value.
+fewest_jumps = [None]
+owl_chance = [None]
+for num_owls in range(1, 7):
+    reach = [[] for _ in range(board_len)]
+    for pos in range(board_len - 1):
+        for card in cards[:-1]:
+            square = pos
+            for _ in range(num_owls):
+                square = next_square[card][square]
+                if square == board_len - 1:
+                    break
+            reach[pos].append(square)
+    jumps = [0] * board_len
+    for pos in range(board_len - 2, -1, -1):
+        # Landing further ahead is never worse, so only the furthest squares count
+        jumps[pos] = 1 + min(jumps[square] for square in reach[pos])
+    fewest_jumps.append(jumps)
+    chance = [[0.0] * (board_len - 1) + [1.0] for _ in range(sun_len)]
+    for sun in range(sun_len - 2, -1, -1):
+        for pos in range(board_len - 2, -1, -1):
+            value = card_probabilities["sun"] * chance[sun + 1][pos]
+            for c in range(len(cards) - 1):
+                value += card_probabilities[cards[c]] * chance[sun][reach[pos][c]]
+            chance[sun][pos] = value
+    owl_chance.append(chance)
+
+def static_high(state):
+    # Upper bound on the win probability of a canonical non-terminal state from the
+    # state alone. Playing a turn can't raise its expected value, so it also
+    # bounds any value that backs up estimates kept below it. Widened a little so
+    # rounding can't put it below a value it bounds.
+    num_owls = len(state) - 1
+    least = sum(fewest_jumps[num_owls][pos] for pos in state[:-1])
+    return min(win_chance[sun_len - 1 - state[-1]][least], owl_chance[num_owls][state[-1]][state[-2]]) + 1e-9
+
+# Expected number of color cards an owl at pos needs to reach the nest if it's
+# moved with every color card drawn, ignoring the other owls
+owl_moves = [0.0] * (nest + 1)
+for pos in range(nest - 1, -1, -1):
+    owl_moves[pos] = 1 + sum(owl_moves[next_square[card][pos]] for card in cards[:-1]) / (len(cards) - 1)
+
+# Picking which owl to move with each card makes better progress than moving every
+# owl with every card, so the owls need fewer cards together than on their own.
+# The more owls there are to pick from, the bigger the difference. The scale was
+# fitted against the DP agent's values for 3 and 4 owls, where the estimates are
+# within about 0.03 to 0.04 of the real win probability on average.
+move_scale = 1.2
+
+def need_chance(suns, need):
+    # Chance of drawing need color cards before suns sun cards, interpolated
+    # between whole numbers of cards
+    chances = win_chance[suns]
+    whole = int(need)
+    if whole + 1 >= len(chances):
+        return 0.0
+    return chances[whole] + (need - whole) * (chances[whole + 1] - chances[whole])
+
+def estimate(state):
+    # Estimated win probability of a non-terminal state: the chance of drawing the
+    # color cards the owls still need before the sun reaches the end
+    moving = [pos for pos in state[:-1] if pos != nest]
+    return need_chance(sun_len - 1 - state[-1],
+                       move_scale / math.sqrt(len(moving)) * sum(owl_moves[pos] for pos in moving))
+
+# The static bound is far too loose to prune with, so states searched ahead get a
+# bound from the estimates the search can reach instead. Knowing every card before
+# it's drawn can only help, so the value of a search is at most the chance of each
+# mix of sun and color cards times the best estimate those cards could reach. Each
+# color card moves one owl, and cuts the owl_moves total by at most max_drop.
+#
+# owl_moves never goes up as an owl moves forward, and an owl only jumps owls on
+# squares of the card's color, so max_drop[j][pos] is the most one move can cut
+# owl_moves by for an owl at pos or further along that jumps at most j owls.
+max_drop = []
+for jumps in range(6):
+    drops = [0.0] * board_len
+    for pos in range(nest - 1, -1, -1):
+        drop = drops[pos + 1]
+        for card in cards[:-1]:
+            square = pos
+            for _ in range(jumps + 1):
+                square = next_square[card][square]
+                if square == nest:
+                    break
+            drop = max(drop, owl_moves[pos] - owl_moves[square])
+        drops[pos] = drop
+    max_drop.append(drops)
+
+# draw_chance[draws][suns] is the chance of drawing suns sun cards in draws cards
+draw_chance = [[math.comb(draws, suns) * card_probabilities["sun"] ** suns *
+                (1 - card_probabilities["sun"]) ** (draws - suns) for suns in range(draws + 1)]
+               for draws in range(sun_len + 1)]
+
+def later_high(suns, total, moving, on_color, back, draws):
+    # Upper bound on the estimate after draws more cards, for moving owls off the
+    # nest whose owl_moves add up to total, none of them behind back, and at most
+    # on_color of them on squares of any one color. Fewer owls off the nest only
+    # scale the estimate's need up, and every move can put one more owl on a color.
+    if moving == 0:
+        return 1.0
+    scale = move_scale / math.sqrt(moving)
+    high = 0.0
+    drop = 0.0
+    for moves in range(draws + 1):
+        if draws - moves >= suns:
+            # The sun reaches the end unless the owls get to the nest first
+            value = 1.0 if drop >= total else 0.0
+        else:
+            value = need_chance(suns - (draws - moves), scale * max(0.0, total - drop))
+        high += draw_chance[draws][draws - moves] * value
+        drop += max_drop[min(on_color + moves, moving - 1)][back]
+    return high
+
+def search_high(state, depth):
+    # Upper bound on the value of a canonical non-terminal state searched depth
+    # card draws ahead. The moves of the first card are tried for real, and
+    # later_high bounds the draws after it, so a search one draw ahead gets its
+    # exact value unless the static bound cuts the estimates down.
+    owls = state[:-1]
+    moving = [pos for pos in owls if pos != nest]
+    total = sum(owl_moves[pos] for pos in moving)
+    on_color = max(sum(1 for pos in moving if board[pos] == card) for card in cards[:-1])
+    suns = sun_len - 1 - state[-1]
+    high = 0.0
+    if suns > 1:
+        high += card_probabilities["sun"] * later_high(suns - 1, total, len(moving), on_color, moving[-1],
+                                                       depth - 1)
+    for card in cards[:-1]:
+        # A bigger drop never raises the bound, so only the biggest one counts,
+        # apart from owls reaching the nest, which leave fewer owls to scale by
+        squares = next_square[card]
+        drop = home = -1.0
+        for pos in moving:
+            square = squares[pos]
+            while square != nest and square in owls:
+                square = squares[square]
+            if square == nest:
+                home = max(home, owl_moves[pos])
+            else:
+                drop = max(drop, owl_moves[pos] - owl_moves[square])
+        best = 0.0
+        if drop >= 0.0:
+            best = later_high(suns, total - drop, len(moving), on_color + 1, moving[-1], depth - 1)
+        if home >= 0.0:
+            best = max(best, later_high(suns, total - home, len(moving) - 1, on_color + 1, moving[-1], depth - 1))
+        high += card_probabilities[card] * best
+    # Widened a little so rounding can't put it below the value
+    return high + 1e-9
+
+# Transposition cache keyed by canonical state and the number of card draws it was
+# searched ahead. Each entry is a lower and upper bound on its value, which are
+# equal if the value is exact.
+cache = {}
+
+# The value at the depth limit and bounds on the value of every state seen, keyed
+# by canonical state
+leaves = {}
+
+# The states we can move to with each card from every state searched, so states
+# searched again with a different window don't have to generate them again
+children = {}
+
+# Each of them is cleared when it reaches this many entries
+max_cache = 1000000
+
+# Chance node bounds within this of the window are treated as outside it, so
+# rounding in the sums can't keep a node searching after a card failed low or high
+slack = 1e-12
+
+# Star1 windows and skipping moves that can't beat the best move found ("star1"),
+# or searching every card and move in full ("none")
+pruning = "star1"
+
+# Chance nodes searched so far, and the time to give up searching by if any
+deadline = None
+nodes = 0
+
+class OutOfTime(Exception):
+    pass
+
+def canonical_state(state):
+    # Owls are interchangeable, so every ordering of the same owls has one entry
+    return tuple(sorted(state[:-1], reverse=True)) + (state[-1],)
+
+def leaf(state):
+    # Returns the value of a canonical state at the depth limit, and a lower and
+    # upper bound on its value at any depth. Playing a turn can't take the expected
+    # upper bound of the next state past the bound of this one, so keeping the
+    # estimates below the bound keeps the values of deeper searches below it too.
+    # Only terminal states have a lower bound above 0.
+    entry = leaves.get(state)
+    if entry is None:
+        if is_terminal(state):
+            value = 0.0 if state[-1] == sun_len - 1 else 1.0
+            entry = (value, value, value)
+        else:
+            high = static_high(state)
+            entry = (min(estimate(state), high), 0.0, high)
+        if len(leaves) >= max_cache:
+            leaves.clear()
+        leaves[state] = entry
+    return entry
+
+def bounds(state, depth):
+    # Lower and upper bound on the value of a canonical state searched depth card
+    # draws ahead, from the cache or the state itself. They're equal if the value
+    # is known.
+    value, low, high = leaf(state)
+    if depth == 0 or low == high:
+        return value, value
+    entry = cache.get((state, depth))
+    if entry is None and pruning != "none":
+        # Cached, so the bound is only worked out once
+        entry = (low, min(high, search_high(state, depth)))
+        if len(cache) >= max_cache:
+            cache.clear()
+        cache[(state, depth)] = entry
+    if entry is not None:
+        return max(low, entry[0]), min(high, entry[1])
+    return low, high
+
+def card_successors(state, depth):
+    # The canonical states we can move to with each card, best estimate first and
+    # without duplicates, along with their bounds searched depth card draws ahead,
+    # and the bounds on the value of each card from the bounds of its moves
+    card_states = children.get(state)
+    if card_states is None:
+        card_states = []
+        for card in cards:
+            states = set(canonical_state(successor(state, move)) for move in legal_moves(state, [card]))
+            card_states.append(sorted(states, key=lambda new_state: leaf(new_state)[0], reverse=True))
+        if len(children) >= max_cache:
+            children.clear()
+        children[state] = card_states
+    moves = []
+    lows = []
+    highs = []
+    for states in card_states:
+        card_moves = [(bounds(new_state, depth), new_state) for new_state in states]
+        moves.append(card_moves)
+        lows.append(max(move_bounds[0] for move_bounds, new_state in card_moves))
+        highs.append(max(move_bounds[1] for move_bounds, new_state in card_moves))
+    return moves, lows, highs
+
+def cutoff(probs, lows, highs, alpha, beta):
+    # Returns a bound on a chance node's value if the bounds on its cards already
+    # put it outside the window, otherwise None. Bounds within the slack of the
+    # window are moved to its edge, so they can't be mistaken for exact values.
+    low = sum(p * low for p, low in zip(probs, lows))
+    if low >= beta - slack:
+        return max(low, beta)
+    high = sum(p * high for p, high in zip(probs, highs))
+    if high <= alpha + slack:
+        return min(high, alpha)
+    return None
+
+def expectimax(state, depth, alpha, beta):
+    # Value of a canonical state, before the next card is drawn, looking depth
+    # card draws ahead. Values outside the (alpha, beta) window are only bounds:
+    # a value at or below alpha is an upper bound and one at or above beta is a
+    # lower bound.
+    global nodes
+    low, high = bounds(state, depth)
+    if low == high or low >= beta:
+        return low
+    if high <= alpha:
+        return high
+    nodes += 1
+    if deadline is not None and time.perf_counter() > deadline:
+        raise OutOfTime()
+
+    moves, lows, highs = card_successors(state, depth - 1)
+    probs = [card_probabilities[card] for card in cards]
+    value = cutoff(probs, lows, highs, alpha, beta)
+
+    # Star1: search each card in the window its value has to fall in to matter,
+    # given the bounds on the other cards. Moves whose upper bound can't beat the
+    # best move found so far or reach the window are skipped.
+    c = 0
+    while value is None and c < len(cards):
+        if lows[c] != highs[c]:
+            others_low = sum(p * low for p, low in zip(probs, lows)) - probs[c] * lows[c]
+            others_high = sum(p * high for p, high in zip(probs, highs)) - probs[c] * highs[c]
+            card_alpha = (alpha - others_high) / probs[c]
+            card_beta = (beta - others_low) / probs[c]
+            best = float("-inf")
+            skipped = float("-inf")
+            for (move_low, move_high), new_state in moves[c]:
+                if pruning != "none" and move_high <= max(card_alpha, best):
+                    skipped = max(skipped, move_high)
+                    continue
+                best = max(best, expectimax(new_state, depth - 1, max(card_alpha, best), card_beta))
+                if best >= card_beta:
+                    break
+            if best >= card_beta:
+                lows[c] = max(lows[c], best)
+            elif best <= card_alpha:
+                # Keep the tightest bound found rather than just alpha, so searching
+                # again with a slightly different window can reuse it
+                highs[c] = min(highs[c], max(best, skipped))
+            else:
+                lows[c] = highs[c] = best
+            value = cutoff(probs, lows, highs, alpha, beta)
+        c += 1
+    if value is None:
+        # Every card is exact
+        value = sum(p * low for p, low in zip(probs, lows))
+
+    # Narrow down the bounds already known at this depth
+    if value <= alpha:
+        high = min(high, value)
+    elif value >= beta:
+        low = max(low, value)
+    else:
+        low = high = value
+    if len(cache) >= max_cache:
+        cache.clear()
+    cache[(state, depth)] = (low, high)
+    return value
+
+def search(state, set_cards, depth, first=None):
+    # Returns the value, card, owl and resulting state of the best move we can make
+    # with our cards, looking depth card draws past it. The first move is searched
+    # first, then the rest best estimate first.
+    moves = []
+    for move in legal_moves(state, set_cards):
+        new_state = canonical_state(successor(state, move))
+        moves.append((move != first, -leaf(new_state)[0], move, new_state))
+    moves.sort()
+    best = None
+    best_value = -1.0
+    searched = set()
+    for is_first, move_value, move, new_state in moves:
+        if new_state in searched or (pruning != "none" and bounds(new_state, depth)[1] <= best_value):
+            continue
+        searched.add(new_state)
+        if pruning == "none":
+            # An infinite window never cuts a chance node off
+            value = expectimax(new_state, depth, -math.inf, math.inf)
+        else:
+            value = expectimax(new_state, depth, best_value, 2.0)
+        if value > best_value:
+            best_value = value
+            best = move
+    card, i, next_pos = best
+    return best_value, card, i, list(successor(state, best))
+
+def get_best_action(state, set_cards, depth=None, seconds=None):
+    # Best move with our cards from a search depth card draws deep, or from
+    # iterative deepening until a time budget in seconds runs out. Returns the
+    # value, card, owl and resulting state of the move and the depth searched.
+    global deadline
+    if "sun" in set_cards:
+        # Have to play sun card if we have it
+        return None, "sun", None, list(successor(state, ("sun", None, None))), 0
+    if depth is not None:
+        deadline = None
+        return search(state, set_cards, depth) + (depth,)
+    deadline = time.perf_counter() + seconds
+    # Always finish depth 0, so there's a move even if the time runs out
+    result = search(state, set_cards, 0) + (0,)
+    try:
+        for depth in range(1, sun_len):
+            # The best move of the last depth is searched first
+            value, card, i, new_state, last_depth = result
+            result = search(state, set_cards, depth, (card, i, new_state[i])) + (depth,)
+    except OutOfTime:
+        pass
+    finally:
+        deadline = None
+    return result
+
+def play_games(start_state, num_games, depth=None, seconds=None, rng=random):
+    # Simulate running the game num_games times, searching before every move, and
+    # return the number of games won
+    def best_action(state, set_cards):
+        return get_best_action(state, set_cards, depth, seconds)[:4]
+    return simulate_games(best_action, start_state, num_games, rng)
+
+def main():
+    global pruning
+    args, options = parse_options(sys.argv[1:])
+    if "stats" in options:
+        # Time searches, chance nodes and games, and read the cache sizes at the end
+        import stats
+        stats.instrument(sys.modules[__name__], ["legal_moves", "expectimax", "search", "play_games"])
+        if not stats.enable(options["stats"], lambda: {"chance nodes": nodes, "cache entries": len(cache),
+                                                      "leaf entries": len(leaves)}):
+            print("Invalid stats format inputted. Please input --stats or --stats=json.")
+            exit(1)
+    depth = options.get("depth")
+    if depth is not None:
+        if depth is True or not depth.isdigit():
+            print("Invalid depth inputted. Please input a non-negative integer.")
+            exit(1)
+        depth = int(depth)
+    pruning = options.get("pruning", "star1")
+    if pruning not in ("star1", "none"):
+        print("Invalid pruning inputted. Please input 'star1' or 'none'.")
+        exit(1)
+    if "batch" in options:
+        # Answer every query in the file
+        seconds = float(options.get("seconds", 1))
+        run_batch(options["batch"], lambda state, set_cards: get_best_action(state, set_cards, depth,
+                                                                                seconds)[:4])
+        return
+
+    # Check command-line arguments
+    if len(args) != 2:
+        print("Usage: ./Expectimax <state> <num_games> or ./Expectimax <state> <card1,card2,card3>")
+        print("       ./Expectimax --batch=<file>")
+        print("Options: --depth=<n> --seconds=<time budget> --ms-per-move=<time budget> " +
+              "--pruning=star1|none --workers=<n> --seed=<n> --trace=<file> --stats[=json]")
+        exit(0)
+
+    state = parse_state(args[0])
+
+    # Evaluation
+    if args[1].isdigit():
+        num_games = int(args[1])
+        workers, seed = worker_options(options)
+        trace = trace_option(options)
+        seconds = float(options.get("ms-per-move", 50)) / 1000
+        play = lambda n, seed: play_games(state, n, depth, seconds, random.Random(seed))
+        wins = run_games(play, num_games, workers, seed, trace)
+        print("Average Win Percentage: " + str(wins / num_games * 100) + "%")
+        return
+
+    set_cards = parse_cards(args[1])
+    if is_terminal(state):
+        print("Inputted state is terminal; no action possible")
+        exit(0)
+    if "sun" in set_cards:
+        print("Sun card in hand; you must play it")
+        exit(0)
+    start_time = time.time()
+    best_prob, best_action, best_owl, best_state, depth = get_best_action(state, set_cards, depth,
+                                                                          float(options.get("seconds", 1)))
+    print("Best action to take is to move owl " + str(best_owl + 1) +
+          " using card " + best_action + ", resulting in position " +
+          str(best_state) + " with estimated win probability " + str(best_prob))
+    print("Searched " + str(depth) + " card draws ahead (" + str(nodes) + " chance nodes in " +
+          str(round(time.time() - start_time, 2)) + " seconds)")
+
+
+if __name__ == "__main__":
+    main()
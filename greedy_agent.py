@@ -1,134 +1,115 @@
 # Greedy Agent for Hoot Owl Hoot
 import sys
+import time
+import functools
 import random
+from engine import cards, card_weights, is_terminal, legal_moves, successor, simulate_games, evaluate_policy
+from engine import parse_state, parse_cards, parse_options, run_games, worker_options, run_batch
+from traces import trace_option
 
-board = ["yellow", "green", "orange", "blue", "purple", "red", "blue", "purple", 
-         "red", "yellow", "green", "blue", "orange", "red", "purple", "yellow", 
-         "green", "orange", "blue", "purple", "red", "green", "yellow", "orange", 
-         "blue", "purple", "red", "yellow", "green", "blue", "orange", "red", 
-         "purple", "yellow", "green", "blue", "orange", "red", "purple", "nest"]
-
-cards = ["blue", "purple", "red", "yellow", "green", "orange", "sun"]
-
-board_len = len(board)
-sun_len = 14
-
-card_probabilities = {
-    "blue": 0.12,
-    "purple": 0.12,
-    "red": 0.12,
-    "yellow": 0.12,
-    "green": 0.12,
-    "orange": 0.12,
-    "sun": 0.28
-}
-
-def is_terminal(state):
-    # Checks that either the sun has reached the end or all owls are at the end
-    return state[-1] == sun_len - 1 or all([pos == board_len - 1 for pos in state[:-1]])
-
+# Position of each card in cards, used to break ties
+card_rank = {card: c for c, card in enumerate(cards)}
 
 def get_best_action(state, set_cards):
-    # Returns the best action we can take given the current state and the cards
+    # Returns the best action we can take given the current state and the cards.
+    # Ties go to the card that comes first in cards and then to the owl furthest
+    # ahead, so the move doesn't depend on the order of the owls or the hand.
     best_action = None
     best_progress = float("-inf")
     best_owl = None
+    best_order = None
 
-    if "sun" in set_cards:
-        next_sun = state[-1] + 1
-        new_state = list(state[:-1] + [next_sun])
-        best_action = "sun"
-        best_owl = None
-        best_state = new_state
-        return best_progress, best_action, best_owl, best_state
+    for move in legal_moves(state, set_cards):
+        card, i, next_pos = move
+        # Have to play sun card if we have it
+        if card == "sun":
+            return best_progress, card, None, list(successor(state, move))
+        # Calculate forward progress made from this move and compare to best progress
+        progress = next_pos - state[i]
+        order = (progress, -card_rank[card], state[i])
+        if best_order is None or order > best_order:
+            best_order = order
+            best_progress = progress
+            best_action = card
+            best_owl = i
+            best_state = list(successor(state, move))
+    return best_progress, best_action, best_owl, best_state
 
+@functools.lru_cache(maxsize=64)
+def card_move(state, card):
+    # get_best_action with a single card, cached since evaluate_policy asks about
+    # every hand of a state in a row
+    return get_best_action(list(state), [card])
+
+def policy_moves(state, set_cards):
+    # The greedy move is the only move the policy makes, for evaluate_policy. It's
+    # the best move of the card whose best move makes the most progress, first in
+    # cards on ties, like in get_best_action.
+    state = tuple(state)
+    best = None
     for card in set_cards:
-        owls = state[:-1]
-        for i in range(len(state) - 1):
-            if state[i] == board_len - 1:
-                continue
-            for j in range(state[i] + 1, board_len):
-                if board[j] == "nest":
-                    next_pos = j
-                    break
-                elif board[j] == card and j not in owls:
-                    next_pos = j
-                    break
-            new_state = list(state)
-            new_state[i] = next_pos
-            # Calculate forward progress made from this move and compare to best progress
-            progress = next_pos - state[i]
-            if progress > best_progress:
-                best_progress = progress
-                best_action = card
-                best_owl = i
-                best_state = new_state
-    return best_progress, best_action, best_owl, best_state
+        move = card_move(state, card)
+        if best is None or move[0] > best[0] or (move[0] == best[0] and card_rank[card] < card_rank[best[1]]):
+            best = move
+    best_progress, best_action, best_owl, best_state = best
+    return [(1, best_action, best_state)]
+
+def play_games(start_state, num_games, rng=random):
+    # Simulate running the game num_games times, choosing best action every time,
+    # and return the number of games won
+    return simulate_games(get_best_action, start_state, num_games, rng)
     
 
 def main():
+    args, options = parse_options(sys.argv[1:])
+    if "stats" in options:
+        # Time move generation, best action queries and games
+        import stats
+        stats.instrument(sys.modules[__name__], ["legal_moves", "get_best_action", "play_games"])
+        if not stats.enable(options["stats"]):
+            print("Invalid stats format inputted. Please input --stats or --stats=json.")
+            exit(1)
+    if "batch" in options:
+        # Answer every query in the file
+        run_batch(options["batch"], get_best_action)
+        return
+
     # Check command-line arguments
-    if len(sys.argv) != 3:
+    if len(args) != 2 and not (len(args) == 1 and "exact" in options):
         print("Usage: ./Greedy <state> <num_games> or ./Greedy <state> <card1,card2,card3>")
+        print("       ./Greedy <state> --exact or ./Greedy --batch=<file>")
+        print("Options: --vectorized --workers=<n> --seed=<n> --trace=<file> --stats[=json]")
         exit(0)
     
-    state = sys.argv[1]
-    state = state.split(",")
-    state = [int(x) for x in state]
+    state = parse_state(args[0])
 
-    # Error checking
-    owl_pos = state[:-1]
-    sun_pos = state[-1]
-    if sun_pos < 0 or sun_pos >= sun_len:
-        print("Invalid sun position inputted. Sun position should be between 0 and 13.")
-        exit(1)
-    for pos in owl_pos:
-        if pos < 0 or pos >= board_len:
-            print("Invalid owl position inputted. Owl positions should be between 0 and 39.")
-            exit(1)
-        # Check if two owl positions are the same
-        if owl_pos.count(pos) > 1 and pos != 39:
-            print("Invalid owl positions inputted. Owl positions should be unique.")
-            exit(1)
-    if len(state) < 4 or len(state) > 7:
-        print("Invalid state inputted. States should consist of 3-6 owl positions and the sun position.")
-        exit(1)
+    if "exact" in options:
+        # Exact win probability of the policy instead of simulating games
+        start_time = time.time()
+        win_prob, num_states = evaluate_policy(policy_moves, state)
+        print("Exact Win Percentage: " + str(win_prob * 100) + "% (" + str(num_states) +
+              " states evaluated in " + str(round(time.time() - start_time, 2)) + " seconds)")
+        return
 
     # Evaluation
-    if sys.argv[2].isdigit():
-        num_games = int(sys.argv[2])
-        # Simulate running the game num_games times, choosing best action every time
-        # and outputting the average win probability
-        wins = 0
-        start_state = state
-        for _ in range(num_games):
-            # Always start from beginning
-            probabilities = [0.12, 0.12, 0.12, 0.12, 0.12, 0.12, 0.28]
-            state = start_state
-            # Pick 3 random cards
-            random_cards = random.choices(cards, probabilities, k=3)
-            while not is_terminal(state):
-                best_prob, best_action, best_owl, best_state = get_best_action(state, random_cards)
-                state = best_state
-                # Remove the card we played from our set and add a new random card
-                random_cards.remove(best_action)
-                random_cards.append(random.choices(cards, probabilities)[0])
-            if state[-1] == sun_len - 1:
-                wins += 0
-            else:
-                wins += 1
+    if args[1].isdigit():
+        num_games = int(args[1])
+        workers, seed = worker_options(options)
+        trace = trace_option(options)
+        if "vectorized" in options:
+            # NumPy is only needed for the vectorized simulator
+            import batch_sim
+            policy = batch_sim.greedy_policy
+            play = lambda n, seed: batch_sim.simulate(policy, state, n, card_weights, seed)
+        else:
+            play = lambda n, seed: play_games(state, n, random.Random(seed))
+        wins = run_games(play, num_games, workers, seed, trace)
         print("Average Win Percentage: " + str(wins / num_games * 100) + "%")
+        if "vectorized" in options:
+            print("95% confidence interval: +/- " + str(batch_sim.confidence_interval(wins, num_games)) + "%")
         return
 
-    set_cards = sys.argv[2]
-    set_cards = set_cards.split(",")
-    if len(set_cards) != 3:
-        print("Invalid number of cards inputted. Please input 3 cards.")
-        exit(1)
-    for card in set_cards:
-        if card not in cards:
-            print("Invalid card inputted. Please input a valid card.")
-            exit(1)
+    set_cards = parse_cards(args[1])
     if is_terminal(state):
         print("Inputted state is terminal; no action possible")
         exit(0)
@@ -1,157 +1,542 @@
 # MCTS Agent for Hoot Owl Hoot
 import sys
 import math
+import time
 import random
+import engine
+from engine import cards, nest, sun_len, next_square, card_probabilities, card_weights, is_terminal
+from engine import legal_moves, successor, parse_state, parse_cards, parse_options
+from engine import run_parallel, worker_seeds, worker_options, run_batch
+from traces import trace_option, TraceWriter
 
-board = ["yellow", "green", "orange", "blue", "purple", "red", "blue", "purple", 
-         "red", "yellow", "green", "blue", "orange", "red", "purple", "yellow", 
-         "green", "orange", "blue", "purple", "red", "green", "yellow", "orange", 
-         "blue", "purple", "red", "yellow", "green", "blue", "orange", "red", 
-         "purple", "yellow", "green", "blue", "orange", "red", "purple", "nest"]
-
-cards = ["blue", "purple", "red", "yellow", "green", "orange", "sun"]
-
-board_len = len(board)
-sun_len = 14
-
-# Uniform probability distribution based on real deck.
-# Six cards of each color and 14 sun cards.
-card_probabilities = {
-    "blue": 0.12,
-    "purple": 0.12,
-    "red": 0.12,
-    "yellow": 0.12,
-    "green": 0.12,
-    "orange": 0.12,
-    "sun": 0.28
-}
+# Search tree, mapping each state that has been visited to its node
+tree = {}
 
-visited = {}
+# Memory limit for the tree in bytes (set by --max-mb), or None for no limit. Once
+# the tree holds more nodes than fit in the limit, the least recently used nodes are
+# evicted. table_stats counts transposition table hits, misses and evictions, and
+# clock counts iterations so nodes know when they were last used.
+max_bytes = None
+table_stats = {"hits": 0, "misses": 0, "evictions": 0}
+clock = 0
 
-def is_terminal(state):
-    # Checks that either the sun has reached the end or all owls are at the end
-    return state[-1] == sun_len - 1 or all([pos == board_len - 1 for pos in state[:-1]])
+# Rollout policy used by simulate, one of the names in rollouts (set by --rollout)
+rollout_policy = "random"
 
-# Get all possible actions given the current state
-def get_actions(state):
-    # Returns all the possible actions we can take given the current state
-    actions = []
-    # For each card
-    for card in cards:
-        # For each owl
-        for i in range(len(state) - 1):
-            # Skip owls at nest
-            if state[i] == board_len - 1:
-                continue
-            # Find the next position we can move to with the card and save it in actions
-            for j in range(state[i] + 1, board_len):
-                if board[j] == card or board[j] == "nest":
-                    actions.append((card, i, j))
-                    break
-    actions.append(("sun", None, None))
-    return actions
+# Lookup tables for the rollouts, which use card indexes instead of names: the
+# running total of card_probabilities for drawing cards, and next_square by index
+sun_card = len(cards) - 1
+card_totals = []
+for card in cards:
+    card_totals.append((card_totals[-1] if card_totals else 0) + card_probabilities[card])
+color_squares = [next_square[card] for card in cards[:-1]]
 
-# Get the next state given the a state and the action to make in that state
-def successor(state, action):
-    if action[0] == "sun":
-        new_state = list(state)
-        new_state[-1] += 1
-        return tuple(new_state)
+class Node:
+    # Statistics for a state in the search tree. The successor states are generated
+    # once when the node is created, and child nodes are linked to it as they are
+    # added to the tree, so the search never regenerates moves for a node.
+    # A node that has been evicted from the tree keeps its statistics, since parents
+    # may still link to it, but is replaced by a new node the next time it's reached.
+    __slots__ = ("state", "terminal", "child_states", "children", "unvisited", "value", "visits",
+                 "used", "evicted")
 
-    card, owl, next_pos = action
-    new_state = list(state)
-    new_state[owl] = next_pos
-    return tuple(new_state)
+    def __init__(self, state):
+        self.state = state
+        self.terminal = is_terminal(state)
+        if self.terminal:
+            self.child_states = []
+        else:
+            self.child_states = [successor(state, move) for move in get_actions(state)]
+        self.children = [None] * len(self.child_states)
+        self.unvisited = len(self.child_states)
+        self.value = 0
+        self.visits = 0
+        self.used = clock
+        self.evicted = False
 
-def monte_carlo(root):
-    def traverse(state):
-        # UCB formula to balance exploration and exploitation
-        def ucb(parent, children):
-            parent_visits = visited[tuple(parent)][1]
-            return max(children, key=lambda node: (visited[tuple(node)][0] / visited[tuple(node)][1]) + (math.sqrt(2 * math.log(parent_visits) / visited[tuple(node)][1])))
-    
+    def link_children(self):
+        # Links any children that have been added to the tree since the last check.
+        # The tree is shared between states, so a child may have been reached first
+        # through a different parent.
+        for k in range(len(self.children)):
+            if self.children[k] is None:
+                child = tree.get(self.child_states[k])
+                if child is not None:
+                    self.children[k] = child
+                    self.unvisited -= 1
+                    table_stats["hits"] += 1
+
+# Get all possible actions given the current state
+def get_actions(state):
+    # Returns all the possible actions we can take given the current state: every
+    # color card for every owl not at the nest, and the sun
+    return legal_moves(state, cards[:-1]) + [("sun", None, None)]
 
-        children = [successor(state, move) for move in get_actions(state) if successor(state, move) in visited]
+def monte_carlo(root):
+    def traverse(node):
         # While not terminal and all children have been visited, keep traversing down
-        while not is_terminal(state) and len(children) == len(get_actions(state)):
-            state = ucb(state, children)
-            children = [successor(state, move) for move in get_actions(state) if successor(state, move) in visited]
-            path.append(tuple(state))
-        return state
-
-    def expand(state):
-        children = [successor(state, move) for move in get_actions(state) if successor(state, move) not in visited]
-        child = random.choice(children)
-        # Expand leaves by adding them to visited
-        visited[child] = (0, 0)
+        while not node.terminal:
+            if node.unvisited:
+                node.link_children()
+                if node.unvisited:
+                    break
+            # UCB formula to balance exploration and exploitation. A node can be
+            # linked to children it hasn't visited itself, when it's a new root or
+            # its children were roots of earlier searches, so it counts their visits
+            # instead, and children that were never visited are tried first.
+            visits = node.visits or sum(child.visits for child in node.children)
+            exploration = math.sqrt(2 * math.log(visits)) if visits else 0.0
+            best_score = float("-inf")
+            for child in node.children:
+                if not child.visits:
+                    best_child = child
+                    break
+                score = child.value / child.visits + exploration / math.sqrt(child.visits)
+                if score > best_score:
+                    best_score = score
+                    best_child = child
+            if best_child.evicted:
+                # Unlink evicted children so they're added back to the tree
+                node.children[node.children.index(best_child)] = None
+                node.unvisited += 1
+                break
+            node = best_child
+            path.append(node)
+        return node
+
+    def expand(node):
+        unvisited = [k for k in range(len(node.children)) if node.children[k] is None]
+        k = random.choice(unvisited)
+        # Expand leaves by adding them to the tree, unless the state is already there
+        child = tree.get(node.child_states[k])
+        if child is None:
+            child = Node(node.child_states[k])
+            tree[child.state] = child
+            table_stats["misses"] += 1
+        else:
+            table_stats["hits"] += 1
+        node.children[k] = child
+        node.unvisited -= 1
         path.append(child)
         return child
     
     def simulate(state):
-        # Simulate playouts until terminal state
-        while not is_terminal(state):
-            state = successor(state, random.choice(get_actions(state)))
-        return 1 if state[-1] != sun_len - 1 else 0
-    
+        # Simulate playouts until terminal state with the chosen rollout policy
+        return rollouts[rollout_policy](state)
+
     def update(reward):
         # Update the value of each state in the path
         # In a difference from Pset 4, we don't have to consider rewards from
         # a particular player's perspective, as the game is cooperative
-        for state in path:
-            value, visits = visited[tuple(state)]
-            value += reward
-            visited[tuple(state)] = (value, visits + 1)
-    
+        for node in path:
+            node.value += reward
+            node.visits += 1
+            node.used = clock
+
+    global clock
+    clock += 1
     path = [root]
-    s_prime = traverse(root)
-    if not is_terminal(s_prime):
-        child = expand(s_prime)
-        reward = simulate(child)
+    leaf = traverse(root)
+    if not leaf.terminal:
+        child = expand(leaf)
+        reward = simulate(child.state)
     else:
-        reward = 1 if s_prime[-1] != sun_len - 1 else 0
+        reward = 1 if leaf.state[-1] != sun_len - 1 else 0
     update(reward)
     
 
+def uniform_rollout(state):
+    # Picks uniformly from the actions get_actions would return (every color card
+    # for every owl not at the nest, plus the sun) without building the list
+    owls = list(state[:-1])
+    sun = state[-1]
+    moving = [i for i in range(len(owls)) if owls[i] != nest]
+    while sun != sun_len - 1:
+        if not moving:
+            return 1
+        k = int(random.random() * (sun_card * len(moving) + 1))
+        if k == sun_card * len(moving):
+            sun += 1
+        else:
+            i = moving[k % len(moving)]
+            owls[i] = advance(owls, i, k // len(moving))
+            if owls[i] == nest:
+                moving.remove(i)
+    return 0
+
+
+def draw_card():
+    # Draws a card index with the probabilities of the real deck
+    r = random.random()
+    for card in range(sun_card):
+        if r < card_totals[card]:
+            return card
+    return sun_card
+
+
+def advance(owls, i, card):
+    # Square owl i moves to with a color card index, skipping occupied squares
+    # like next_position but on the rollout's own list of owls
+    squares = color_squares[card]
+    pos = squares[owls[i]]
+    while pos != nest and pos in owls:
+        pos = squares[pos]
+    return pos
+
+
+def random_move(owls, hand):
+    # Moves a random owl that isn't at the nest with a random card from the hand
+    slot = int(random.random() * len(hand))
+    i = int(random.random() * len(owls))
+    while owls[i] == nest:
+        i = int(random.random() * len(owls))
+    owls[i] = advance(owls, i, hand[slot])
+    return slot
+
+
+def greedy_move(owls, hand):
+    # Makes the move with the most forward progress, breaking ties by card and then
+    # by the owl furthest ahead like greedy_agent.py
+    best_order = None
+    for slot in range(len(hand)):
+        for i in range(len(owls)):
+            if owls[i] == nest:
+                continue
+            pos = advance(owls, i, hand[slot])
+            order = (pos - owls[i], -hand[slot], owls[i])
+            if best_order is None or order > best_order:
+                best_order = order
+                best_slot = slot
+                best_owl = i
+                best_pos = pos
+    owls[best_owl] = best_pos
+    return best_slot
+
+
+def back_move(owls, hand):
+    # Moves the owl furthest from the nest with a random card from the hand, like
+    # rulebased_agent.py with front set to False
+    best_owl = None
+    for i in range(len(owls)):
+        if owls[i] != nest and (best_owl is None or owls[i] < owls[best_owl]):
+            best_owl = i
+    slot = int(random.random() * len(hand))
+    owls[best_owl] = advance(owls, best_owl, hand[slot])
+    return slot
+
+
+def hand_rollout(state, move):
+    # Plays the rest of the game the way the real game is played: we hold three
+    # cards drawn from the deck's probabilities, a sun card has to be played when
+    # we have one, and otherwise move(owls, hand) moves an owl and returns the slot
+    # of the card it played. The owl positions and hand are updated in place.
+    owls = list(state[:-1])
+    sun = state[-1]
+    hand = [draw_card(), draw_card(), draw_card()]
+    while sun != sun_len - 1:
+        if owls.count(nest) == len(owls):
+            return 1
+        if sun_card in hand:
+            sun += 1
+            slot = hand.index(sun_card)
+        else:
+            slot = move(owls, hand)
+        hand[slot] = draw_card()
+    return 0
+
+
+rollouts = {
+    "uniform": uniform_rollout,
+    "random": lambda state: hand_rollout(state, random_move),
+    "greedy": lambda state: hand_rollout(state, greedy_move),
+    "back": lambda state: hand_rollout(state, back_move),
+}
+
+
+def node_bytes(node):
+    # Rough number of bytes a node takes up in the tree, including its successor
+    # states and the tree's dict entry
+    return (sys.getsizeof(node) + sys.getsizeof(node.child_states) + sys.getsizeof(node.children) +
+            sum(sys.getsizeof(state) for state in node.child_states) + sys.getsizeof(node.state) + 100)
+
+
+def evict(root, max_nodes):
+    # Evicts nodes from the tree until it's a quarter below max_nodes, so sorting
+    # the tree doesn't happen every iteration. The least recently used nodes go
+    # first, and the ones with the fewest visits among those used at the same time.
+    # Nodes on the path of the last iteration, the root and the root's children
+    # (the moves we pick from) are never evicted.
+    keep = set(id(child) for child in root.children if child is not None)
+    nodes = [node for node in tree.values() if node.used < clock and id(node) not in keep]
+    nodes.sort(key=lambda node: (node.used, node.visits))
+    for node in nodes[:len(tree) - max_nodes * 3 // 4]:
+        del tree[node.state]
+        node.evicted = True
+        node.child_states = []
+        node.children = []
+        table_stats["evictions"] += 1
+
+
+def grow(state, iterations=None, seconds=None):
+    # Runs MCTS iterations from state, reusing its node if it's already in the tree,
+    # until the number of iterations or the time budget in seconds is used up.
+    # Returns the number of iterations run.
+    root = tree.get(tuple(state))
+    if root is None:
+        root = Node(tuple(state))
+        tree[root.state] = root
+        table_stats["misses"] += 1
+    else:
+        table_stats["hits"] += 1
+    # The root has the most successors of any node in its subtree, so its size is
+    # used for all of them
+    max_nodes = max(max_bytes // node_bytes(root), 1) if max_bytes is not None else None
+    start_time = time.time()
+    count = 0
+    while (iterations is None or count < iterations) and (seconds is None or time.time() - start_time < seconds):
+        monte_carlo(root)
+        count += 1
+        if max_nodes is not None and len(tree) > max_nodes:
+            evict(root, max_nodes)
+    return count
+
+
+def prune(state):
+    # Owls and the sun only move forward, so nodes with the sun or any owl behind
+    # state can never be reached again. Dropping them keeps the subtree under state,
+    # including the children of every node we keep.
+    for key in list(tree):
+        if any(key[k] < state[k] for k in range(len(state))):
+            del tree[key]
+
+
+def hand_moves(state, set_cards):
+    # Returns (card, owl, next position, resulting state) for every move we can make
+    # with our cards
+    return [move + (list(successor(state, move)),) for move in legal_moves(state, set_cards)]
+
+
+def pick_move(moves, visits):
+    # Returns the move whose resulting state was visited the most and its visits,
+    # or None if none of them were visited
+    best_move = None
+    best_value = float("-inf")
+    for m in range(len(moves)):
+        if visits[m] > 0 and visits[m] > best_value:
+            best_value = visits[m]
+            best_move = moves[m]
+    return best_move, best_value
+
+
+def search(state, iterations, seconds=None, seed=None, candidates=()):
+    # Builds a new tree from state for the given number of iterations, stopping
+    # early if a time budget in seconds runs out. Returns the (value, visits) of
+    # each candidate state, the number of iterations run, the time taken and the
+    # transposition table counters.
+    random.seed(seed)
+    tree.clear()
+    for name in table_stats:
+        table_stats[name] = 0
+    start_time = time.time()
+    count = grow(state, iterations, seconds)
+    stats = []
+    for candidate in candidates:
+        node = tree.get(candidate)
+        stats.append((node.value, node.visits) if node is not None else (0, 0))
+    return stats, count, time.time() - start_time, dict(table_stats, nodes=len(tree))
+
+
+def get_best_action(state, set_cards, iterations, seconds=None, seed=None):
+    # Runs MCTS from state and returns the rollout win rate, card, owl and resulting
+    # state of the move we can make with our cards that was visited the most
+    moves = hand_moves(state, set_cards)
+    if len(moves) == 1:
+        card, i, next_pos, new_state = moves[0]
+        return None, card, i, new_state
+    stats, count, elapsed, counters = search(state, iterations, seconds, seed, [tuple(move[3]) for move in moves])
+    move, visits = pick_move(moves, [visits for value, visits in stats])
+    if move is None:
+        raise ValueError("Please run with more iterations.")
+    value, visits = stats[moves.index(move)]
+    card, i, next_pos, new_state = move
+    return value / visits, card, i, new_state
+
+
+def play_games(start_state, num_games, seconds, rng=random):
+    # Plays num_games full games, running MCTS for a fixed amount of time before
+    # every move. The tree is kept between moves, so the search continues from the
+    # subtree under the state we actually end up in. Returns the number of games won
+    # and the time taken by each move.
+    wins = 0
+    move_times = []
+    for _ in range(num_games):
+        # Always start from beginning
+        tree.clear()
+        state = tuple(start_state)
+        # Pick 3 random cards
+        random_cards = rng.choices(cards, card_weights, k=3)
+        while not is_terminal(state):
+            start_time = time.time()
+            if "sun" in random_cards:
+                # Have to play sun card if we have it
+                card = "sun"
+                if engine.tracer is not None:
+                    engine.tracer.record(state, random_cards, card, None)
+                state = successor(state, ("sun", None, None))
+            else:
+                grow(state, seconds=seconds)
+                moves = hand_moves(state, random_cards)
+                visits = []
+                for card, i, next_pos, new_state in moves:
+                    node = tree.get(tuple(new_state))
+                    visits.append(node.visits if node is not None else 0)
+                move, value = pick_move(moves, visits)
+                if move is None:
+                    move = moves[0]
+                card = move[0]
+                if engine.tracer is not None:
+                    engine.tracer.record(state, random_cards, card, move[1])
+                state = tuple(move[3])
+            prune(state)
+            move_times.append(time.time() - start_time)
+            # Remove the card we played from our set and add a new random card
+            random_cards.remove(card)
+            random_cards.append(rng.choices(cards, card_weights)[0])
+        if engine.tracer is not None:
+            engine.tracer.end_game(state)
+        if state[-1] != sun_len - 1:
+            wins += 1
+    return wins, move_times
+
+
+def print_table_stats(counters):
+    # Prints the transposition table counters
+    print("Transposition table: " + str(counters["nodes"]) + " nodes, " + str(counters["hits"]) +
+          " hits, " + str(counters["misses"]) + " misses, " + str(counters["evictions"]) + " evictions")
+
+
+def enable_stats(option):
+    # Instruments the search for --stats. Every MCTS iteration, move generation
+    # for new nodes, rollout, search and move choice is timed, and the tree size and
+    # transposition table counters are read at the end. Returns False if the option
+    # isn't valid.
+    import stats
+    stats.instrument(sys.modules[__name__], ["monte_carlo", "get_actions", "grow", "prune",
+                                             "get_best_action", "play_games"])
+    for name in rollouts:
+        rollouts[name] = stats.timed(rollouts[name], "rollout")
+    return stats.enable(option, lambda: {"tree nodes": len(tree), "transposition hits": table_stats["hits"],
+                                         "transposition misses": table_stats["misses"],
+                                         "evictions": table_stats["evictions"]})
+
+
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: ./MCTS <state> <iterations> <cards>")
+    global rollout_policy, max_bytes
+    args, options = parse_options(sys.argv[1:])
+    if "stats" in options and not enable_stats(options["stats"]):
+        print("Invalid stats format inputted. Please input --stats or --stats=json.")
+        exit(1)
+    rollout_policy = options.get("rollout", "random")
+    if rollout_policy not in rollouts:
+        print("Invalid rollout policy inputted. Please input one of: " + ", ".join(rollouts))
+        exit(1)
+    workers, seed = worker_options(options)
+    if "max-mb" in options:
+        try:
+            max_mb = float(options["max-mb"])
+        except (TypeError, ValueError):
+            max_mb = 0
+        if max_mb <= 0:
+            print("Invalid memory limit inputted. Please input a positive number of megabytes.")
+            exit(1)
+        # Each worker gets an equal share of the limit
+        max_bytes = int(max_mb * 1024 * 1024 / workers)
+    if "batch" in options:
+        # Answer every query in the file, each with its own search. Every query
+        # gets its own seed derived from --seed, so results don't depend on the
+        # queries before it.
+        if len(args) > 1 or (args and not args[0].isdigit()):
+            print("Usage: ./MCTS --batch=<file> <iterations>")
+            exit(1)
+        iterations = int(args[0]) if args else 10000
+        seconds = float(options["seconds"]) if "seconds" in options else None
+        seeder = random.Random(seed)
+        run_batch(options["batch"], lambda state, set_cards: get_best_action(
+            state, set_cards, iterations, seconds, seeder.getrandbits(64) if seed is not None else None))
+        return
+
+    if len(args) == 2 and args[1].isdigit():
+        # Play full games with a time budget per move
+        num_games = int(args[1])
+        state = parse_state(args[0])
+        seconds = float(options.get("ms-per-move", 50)) / 1000
+        random.seed(seed)
+        trace = trace_option(options)
+        if trace is not None:
+            engine.tracer = TraceWriter(trace)
+        wins, move_times = play_games(state, num_games, seconds)
+        if trace is not None:
+            engine.tracer.close()
+        print("Average Win Percentage: " + str(wins / num_games * 100) + "%")
+        if move_times:
+            print("Average time per move: " + str(round(sum(move_times) / len(move_times) * 1000, 1)) +
+                  " ms (max " + str(round(max(move_times) * 1000, 1)) + " ms)")
+        if max_bytes is not None:
+            print_table_stats(dict(table_stats, nodes=len(tree)))
+        return
+
+    if len(args) != 3:
+        print("Usage: ./MCTS <state> <iterations> <cards> or ./MCTS <state> <num_games>")
+        print("       ./MCTS --batch=<file> <iterations>")
+        print("Options: --workers=<n> --seed=<n> --seconds=<time budget> --ms-per-move=<time budget>")
+        print("         --rollout=random|uniform|greedy|back --max-mb=<memory limit> --trace=<file> --stats[=json]")
         sys.exit(0)
     
-    iterations = int(sys.argv[2])
-    state = sys.argv[1].split(",")
-    state = [int(x) for x in state]
-    visited[tuple(state)] = (0, 0)
-    
-    for _ in range(iterations):
-        monte_carlo(state)
-    
-    set_cards = sys.argv[3].split(",")
-    best_action = None
-    best_state = None
-    best_value = float("-inf")
-    for card in set_cards:
-        owls = state[:-1]
-        for i in range(len(owls)):
-            for j in range(state[i] + 1, board_len):
-                if board[j] == "nest":
-                    next_pos = j
-                    break
-                elif board[j] == card and j not in owls:
-                    next_pos = j
-                    break
-            new_state = list(state)
-            new_state[i] = next_pos
-            if visited.get(tuple(new_state), (0, 0))[1] > 0 and visited[tuple(new_state)][1] > best_value:
-                best_value = visited[tuple(new_state)][1]
-                best_action = (card, i, j)
-                best_state = new_state
-    if best_action:
-        print("Best action to take is to move owl " + str(best_action[1] + 1) + 
-        " using card " + best_action[0] + ", resulting in position " + 
+    iterations = int(args[1])
+    state = parse_state(args[0])
+    set_cards = parse_cards(args[2])
+    if is_terminal(state):
+        print("Inputted state is terminal; no action possible")
+        exit(0)
+    if "sun" in set_cards:
+        print("Sun card in hand; you must play it")
+        exit(0)
+    seconds = float(options["seconds"]) if "seconds" in options else None
+
+    # States we can move to with our cards
+    moves = hand_moves(state, set_cards)
+    candidates = [tuple(new_state) for card, i, next_pos, new_state in moves]
+
+    # Root parallelization: each worker builds its own tree from the same root with
+    # its own seed, and the statistics of the moves we can make are summed up
+    shares = [iterations // workers + (k < iterations % workers) for k in range(workers)]
+    seeds = worker_seeds(seed, workers)
+    jobs = [(state, shares[k], seconds, seeds[k], candidates) for k in range(workers)]
+    start_time = time.time()
+    results = run_parallel(search, jobs)
+    elapsed = time.time() - start_time
+    if "workers" in options:
+        for k in range(workers):
+            stats, count, worker_time, counters = results[k]
+            print("Worker " + str(k + 1) + ": " + str(count) + " iterations in " +
+                  str(round(worker_time, 2)) + " seconds (" +
+                  str(round(count / max(worker_time, 1e-9))) + " iterations per second)")
+        total = sum(count for stats, count, worker_time, counters in results)
+        print("All workers: " + str(total) + " iterations in " + str(round(elapsed, 2)) +
+              " seconds (" + str(round(total / max(elapsed, 1e-9))) + " iterations per second)")
+    visits = [sum(stats[m][1] for stats, count, worker_time, counters in results) for m in range(len(moves))]
+    if max_bytes is not None:
+        print_table_stats({name: sum(result[3][name] for result in results) for name in results[0][3]})
+
+    best_move, best_value = pick_move(moves, visits)
+    if best_move:
+        card, i, next_pos, best_state = best_move
+        print("Best action to take is to move owl " + str(i + 1) + 
+        " using card " + card + ", resulting in position " + 
         str(best_state) + " with " + str(best_value) + " visits")
     else:
         print("Please run with more iterations.")
 
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
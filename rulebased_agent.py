@@ -1,48 +1,23 @@
 # Rule-Based Agent for Hoot Owl Hoot
 import sys
+import time
 import random
+from engine import card_weights, board_len, is_terminal, next_position, legal_moves, successor
+from engine import simulate_games, parse_state, parse_cards, parse_options, run_games, worker_options
+from engine import run_batch, evaluate_policy
+from traces import trace_option
 
-board = ["yellow", "green", "orange", "blue", "purple", "red", "blue", "purple", 
-         "red", "yellow", "green", "blue", "orange", "red", "purple", "yellow", 
-         "green", "orange", "blue", "purple", "red", "green", "yellow", "orange", 
-         "blue", "purple", "red", "yellow", "green", "blue", "orange", "red", 
-         "purple", "yellow", "green", "blue", "orange", "red", "purple", "nest"]
-
-cards = ["blue", "purple", "red", "yellow", "green", "orange", "sun"]
-
-board_len = len(board)
-sun_len = 14
-
-card_probabilities = {
-    "blue": 0.12,
-    "purple": 0.12,
-    "red": 0.12,
-    "yellow": 0.12,
-    "green": 0.12,
-    "orange": 0.12,
-    "sun": 0.28
-}
-
-def is_terminal(state):
-    # Checks that either the sun has reached the end or all owls are at the end
-    return state[-1] == sun_len - 1 or all([pos == board_len - 1 for pos in state[:-1]])
-
-def get_best_action(state, set_cards, front):
+def get_best_action(state, set_cards, front, rng=random):
     # Returns the best action we can take given the current state and the cards
-    best_action = None
     if front:
         best_progress = float("-inf")
     else:
         best_progress = float("inf")
-    best_owl = None
 
+    # Have to play sun card if we have it
     if "sun" in set_cards:
-        next_sun = state[-1] + 1
-        new_state = list(state[:-1] + [next_sun])
-        best_action = "sun"
-        best_owl = None
-        best_state = new_state
-        return best_progress, best_action, best_owl, best_state
+        move = legal_moves(state, set_cards)[0]
+        return best_progress, "sun", None, list(successor(state, move))
 
     best_owl = None
     for i in range(len(state) - 1):
@@ -58,99 +33,113 @@ def get_best_action(state, set_cards, front):
                 best_owl = i
 
     # Pick random card in the set and move that owl to the next available position
-    best_action = random.choice(set_cards)
-    owls = state[:-1]
-    for j in range(state[best_owl] + 1, board_len):
-        if board[j] == "nest":
-            next_pos = j
-            break
-        elif board[j] == best_action and j not in owls:
-            next_pos = j
-            break
-    new_state = list(state)
-    new_state[best_owl] = next_pos
+    best_action = rng.choice(set_cards)
+    move = (best_action, best_owl, next_position(state, best_owl, best_action))
+    best_state = list(successor(state, move))
     # Calculate progress made
-    progress = next_pos - state[best_owl]
-    best_progress = progress
-    best_state = new_state
+    best_progress = move[2] - state[best_owl]
     return best_progress, best_action, best_owl, best_state
+
+class PlayCard:
+    # Stands in for the random number generator in get_best_action to make it play
+    # a given card
+    def __init__(self, card):
+        self.card = card
+
+    def choice(self, set_cards):
+        return self.card
+
+def policy_moves(state, set_cards, front):
+    # Every card in the hand is equally likely to be played (twice as likely if we
+    # hold it twice), for evaluate_policy
+    moves = []
+    for card in set_cards:
+        best_progress, best_action, best_owl, best_state = get_best_action(state, set_cards, front, PlayCard(card))
+        moves.append((1 / len(set_cards), best_action, best_state))
+    return moves
+
+def play_games(start_state, num_games, front, rng=random):
+    # Simulate running the game num_games times, choosing best action every time,
+    # and return the number of games won
+    return simulate_games(lambda state, set_cards: get_best_action(state, set_cards, front, rng),
+                          start_state, num_games, rng)
     
 
 def main():
+    args, options = parse_options(sys.argv[1:])
+    if "stats" in options:
+        # Time move generation, best action queries and games
+        import stats
+        stats.instrument(sys.modules[__name__], ["next_position", "get_best_action", "play_games"])
+        if not stats.enable(options["stats"]):
+            print("Invalid stats format inputted. Please input --stats or --stats=json.")
+            exit(1)
+    if "batch" in options and len(args) == 1:
+        # Answer every query in the file with the given rule
+        if args[0] not in ("front", "back"):
+            print("Invalid argument. Please input 'front' or 'back'.")
+            exit(1)
+        workers, seed = worker_options(options)
+        rng = random.Random(seed)
+        run_batch(options["batch"], lambda state, set_cards: get_best_action(state, set_cards, args[0] == "front", rng))
+        return
+
     # Check command-line arguments
-    if len(sys.argv) != 4:
+    if len(args) != 3 and not (len(args) == 2 and "exact" in options):
         print("Usage: ./RuleBased <state> <num_games> <rule> or ./RuleBased <state> <cards> <rule>")
+        print("       ./RuleBased <state> <rule> --exact or ./RuleBased --batch=<file> <rule>")
+        print("Options: --vectorized --workers=<n> --seed=<n> --trace=<file> --stats[=json]")
         exit(0)
     
-    state = sys.argv[1]
-    state = state.split(",")
-    state = [int(x) for x in state]
-
-    # Error checking
-    owl_pos = state[:-1]
-    sun_pos = state[-1]
-    if sun_pos < 0 or sun_pos >= sun_len:
-        print("Invalid sun position inputted. Sun position should be between 0 and 13.")
-        exit(1)
-    for pos in owl_pos:
-        if pos < 0 or pos >= board_len:
-            print("Invalid owl position inputted. Owl positions should be between 0 and 39.")
-            exit(1)
-        # Check if two owl positions are the same
-        if owl_pos.count(pos) > 1 and pos != 39:
-            print("Invalid owl positions inputted. Owl positions should be unique.")
+    state = parse_state(args[0])
+
+    if "exact" in options:
+        # Exact win probability of the rule with every card choice weighed by its
+        # probability, instead of simulating games
+        if args[1] not in ("front", "back"):
+            print("Invalid argument. Please input 'front' or 'back'.")
             exit(1)
-    if len(state) < 4 or len(state) > 7:
-        print("Invalid state inputted. States should consist of 3-6 owl positions and the sun position.")
-        exit(1)
+        start_time = time.time()
+        win_prob, num_states = evaluate_policy(
+            lambda state, set_cards: policy_moves(state, set_cards, args[1] == "front"), state)
+        print("Exact Win Percentage: " + str(win_prob * 100) + "% (" + str(num_states) +
+              " states evaluated in " + str(round(time.time() - start_time, 2)) + " seconds)")
+        return
 
     # Evaluation
-    if sys.argv[2].isdigit():
-        num_games = int(sys.argv[2])
-        # Simulate running the game num_games times, choosing best action every time
-        # and outputting the average win probability
-        wins = 0
-        start_state = state
-        if sys.argv[3] == "front":
+    if args[1].isdigit():
+        num_games = int(args[1])
+        if args[2] == "front":
             front = True
-        elif sys.argv[3] == "back":
+        elif args[2] == "back":
             front = False
         else:
             print("Invalid argument. Please input 'front' or 'back'.")
             exit(1)
-        for _ in range(num_games):
-            # Always start from beginning
-            probabilities = [0.12, 0.12, 0.12, 0.12, 0.12, 0.12, 0.28]
-            state = start_state
-            # Pick 3 random cards
-            random_cards = random.choices(cards, probabilities, k=3)
-            while not is_terminal(state):
-                best_prob, best_action, best_owl, best_state = get_best_action(state, random_cards, front)
-                state = best_state
-                # Remove the card we played from our set and add a new random card
-                random_cards.remove(best_action)
-                random_cards.append(random.choices(cards, probabilities)[0])
-            if state[-1] == sun_len - 1:
-                wins += 0
-            else:
-                wins += 1
+        workers, seed = worker_options(options)
+        trace = trace_option(options)
+        if "vectorized" in options:
+            # NumPy is only needed for the vectorized simulator
+            import batch_sim
+            policy = batch_sim.rule_policy(front)
+            play = lambda n, seed: batch_sim.simulate(policy, state, n, card_weights, seed)
+        else:
+            play = lambda n, seed: play_games(state, n, front, random.Random(seed))
+        wins = run_games(play, num_games, workers, seed, trace)
         print("Average Win Percentage: " + str(wins / num_games * 100) + "%")
+        if "vectorized" in options:
+            print("95% confidence interval: +/- " + str(batch_sim.confidence_interval(wins, num_games)) + "%")
         return
 
 
-    set_cards = sys.argv[2]
-    if sys.argv[3] == "front":
+    if args[2] == "front":
         front = True
-    elif sys.argv[3] == "back":
+    elif args[2] == "back":
         front = False
-    set_cards = set_cards.split(",")
-    if len(set_cards) != 3:
-        print("Invalid number of cards inputted. Please input 3 cards.")
+    else:
+        print("Invalid argument. Please input 'front' or 'back'.")
         exit(1)
-    for card in set_cards:
-        if card not in cards:
-            print("Invalid card inputted. Please input a valid card.")
-            exit(1)
+    set_cards = parse_cards(args[1])
     if is_terminal(state):
         print("Inputted state is terminal; no action possible")
         exit(0)
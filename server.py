@@ -0,0 +1,203 @@
+# Decision server for Hoot Owl Hoot
+# Answers queries for all four agents over newline-delimited JSON, so a solved
+# value table stays in memory between queries instead of being solved again for
+# every turn. Each request is a JSON object on its own line, for example
+#   {"id": 1, "agent": "dp", "state": [5, 4, 3, 0], "cards": ["red", "green", "yellow"]}
+# and gets back one JSON line with the move, the resulting state and the agent's
+# value for it, along with how long the request took. Leaving out the cards asks
+# the DP agent for the win probability of the state instead.
+import os
+import sys
+import json
+import math
+import time
+import random
+import threading
+import socketserver
+from engine import is_terminal, state_error, cards_error, parse_state, parse_options
+import dp_agent
+import greedy_agent
+import rulebased_agent
+import mcts_agent
+
+# DP solves and MCTS searches change shared module state (the memo and the search
+# tree), so only one of each runs at a time. Lookups in an already solved memo
+# don't need the lock.
+dp_lock = threading.Lock()
+mcts_lock = threading.Lock()
+
+# Default number of MCTS iterations per query, set by --iterations
+mcts_iterations = 10000
+
+# DP solving engine, set by --engine
+dp_engine = "iterative"
+
+
+def dp_value(state):
+    # Win probability of a state, solving the memo first if needed
+    if isinstance(dp_agent.memo, dp_agent.ValueTable) and dp_agent.memo.num_owls != len(state) - 1:
+        raise ValueError("Value table was solved for " + str(dp_agent.memo.num_owls) + " owls, not " +
+                         str(len(state) - 1) + ".")
+    key = dp_agent.canonical_state(state)
+    if key in dp_agent.memo:
+        return dp_agent.memo[key]
+    with dp_lock:
+        return dp_agent.solve(state, dp_engine)
+
+
+def best_action(request, state, set_cards):
+    # Returns (card, owl, resulting state, value, extra response fields) for the
+    # agent named in the request
+    agent = request.get("agent", "dp")
+    if agent == "dp":
+        dp_value(state)
+        value, card, owl, new_state = dp_agent.get_best_action(state, set_cards)
+        return card, owl, new_state, value, {}
+    if agent == "greedy":
+        value, card, owl, new_state = greedy_agent.get_best_action(state, set_cards)
+        return card, owl, new_state, value, {}
+    if agent == "rulebased":
+        rule = request.get("rule", "back")
+        if rule not in ("front", "back"):
+            raise ValueError("Invalid rule. Please use 'front' or 'back'.")
+        rng = random.Random(request.get("seed"))
+        value, card, owl, new_state = rulebased_agent.get_best_action(state, set_cards, rule == "front", rng)
+        return card, owl, new_state, value, {}
+    if agent == "mcts":
+        iterations = int(request.get("iterations", mcts_iterations))
+        moves = mcts_agent.hand_moves(state, set_cards)
+        candidates = [tuple(move[3]) for move in moves]
+        with mcts_lock:
+            stats, count, elapsed, counters = mcts_agent.search(state, iterations, None, request.get("seed"), candidates)
+        move, visits = mcts_agent.pick_move(moves, [visits for value, visits in stats])
+        if move is None:
+            raise ValueError("No moves were visited. Please use more iterations.")
+        value, visits = stats[moves.index(move)]
+        card, owl, next_pos, new_state = move
+        return card, owl, new_state, value / visits, {"visits": visits, "iterations": count}
+    raise ValueError("Invalid agent. Please use 'dp', 'greedy', 'rulebased' or 'mcts'.")
+
+
+def answer(request):
+    # Returns the response to a single request
+    state = request.get("state")
+    if not isinstance(state, list) or not all(isinstance(x, int) for x in state) or len(state) < 2:
+        raise ValueError("Invalid state. Please send a list of owl positions and the sun position.")
+    error = state_error(state)
+    if error:
+        raise ValueError(error)
+    if "cards" not in request:
+        if request.get("agent", "dp") != "dp":
+            raise ValueError("Only the DP agent can answer win probability queries.")
+        return {"value": dp_value(state)}
+    set_cards = request["cards"]
+    error = cards_error(set_cards) if isinstance(set_cards, list) else "Invalid cards. Please send a list of 3 cards."
+    if error:
+        raise ValueError(error)
+    if is_terminal(state):
+        raise ValueError("Inputted state is terminal; no action possible")
+    card, owl, new_state, value, extra = best_action(request, state, set_cards)
+    # Greedy and rule-based agents have no value for a sun move
+    if value is not None and not math.isfinite(value):
+        value = None
+    response = {"card": card, "owl": owl + 1 if owl is not None else None, "state": list(new_state), "value": value}
+    response.update(extra)
+    return response
+
+
+def handle(line):
+    # Answers one line of input and returns the response line, with the time the
+    # request took in milliseconds
+    start_time = time.perf_counter()
+    request = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("Requests should be JSON objects.")
+        response = answer(request)
+    except (ValueError, TypeError, KeyError) as e:
+        response = {"error": str(e)}
+    if "id" in request:
+        response["id"] = request["id"]
+    response["latency_ms"] = round((time.perf_counter() - start_time) * 1000, 3)
+    return json.dumps(response)
+
+
+def serve_stdio():
+    # Reads requests from stdin and writes responses to stdout until end of input
+    for line in sys.stdin:
+        if line.strip():
+            print(handle(line), flush=True)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    # Answers requests from one socket client, in order, until it disconnects
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                self.wfile.write(handle(line.decode()).encode() + b"\n")
+
+
+def serve_socket(path):
+    # Serves clients on a Unix socket, each one on its own thread
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        print("Listening on " + path, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def main():
+    global mcts_iterations, dp_engine
+    args, options = parse_options(sys.argv[1:])
+    if args or "help" in options:
+        print("Usage: ./Server [--socket=<path>] [--load-table=<file>] [--solve=<state>]")
+        print("Options: --engine=recursive|iterative --iterations=<MCTS iterations> " +
+              "--rollout=random|uniform|greedy|back")
+        exit(0)
+
+    dp_engine = options.get("engine", "iterative")
+    if dp_engine not in ("recursive", "iterative"):
+        print("Invalid engine inputted. Please input 'recursive' or 'iterative'.")
+        exit(1)
+    iterations = options.get("iterations", str(mcts_iterations))
+    if iterations is True or not iterations.isdigit() or int(iterations) < 1:
+        print("Invalid number of iterations inputted. Please input a positive integer.")
+        exit(1)
+    mcts_iterations = int(iterations)
+    mcts_agent.rollout_policy = options.get("rollout", mcts_agent.rollout_policy)
+    if mcts_agent.rollout_policy not in mcts_agent.rollouts:
+        print("Invalid rollout policy inputted. Please input one of: " + ", ".join(mcts_agent.rollouts))
+        exit(1)
+
+    if "load-table" in options:
+        # Queries are answered straight from a table solved by an earlier run
+        try:
+            dp_agent.memo = dp_agent.ValueTable.load(options["load-table"])
+        except (OSError, ValueError) as e:
+            print("Could not load value table: " + str(e))
+            exit(1)
+    if "solve" in options:
+        # Solve ahead of time so the first queries don't have to wait
+        state = parse_state(options["solve"])
+        start_time = time.time()
+        try:
+            dp_value(state)
+        except ValueError as e:
+            print(str(e))
+            exit(1)
+        print("Solved " + str(len(dp_agent.memo)) + " states in " +
+              str(round(time.time() - start_time, 2)) + " seconds", file=sys.stderr)
+
+    if "socket" in options:
+        serve_socket(options["socket"])
+    else:
+        serve_stdio()
+
+
+if __name__ == "__main__":
+    main()
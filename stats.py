@@ -0,0 +1,115 @@
+# Optional instrumentation for the Hoot Owl Hoot agents, enabled with --stats.
+# Nothing here runs unless an agent asks for it: the agents replace the functions
+# they want to measure with wrappers from this module only when --stats is given,
+# and the functions call each other through their module's globals, so every call
+# (including recursive ones) goes through the wrapper. Without --stats the
+# original functions run untouched.
+import sys
+import json
+import time
+import atexit
+
+# Named counters, and the total time and number of calls of every timed function
+counters = {}
+timers = {}
+
+# Set by enable: whether --stats was given, and the function reading the gauges
+enabled = False
+read_gauges = None
+
+# How much worker processes increased each gauge, merged in by merge
+worker_gauges = {}
+
+
+def count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+
+def timed(function, name):
+    # Wraps function so its calls are counted and timed. Times include any timed
+    # functions it calls, so nested phases are counted in both.
+    timers[name] = [0.0, 0]
+
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer = timers[name]
+            timer[0] += time.perf_counter() - start_time
+            timer[1] += 1
+    return wrapper
+
+
+def instrument(module, names):
+    # Replaces each named function in module with a timed wrapper
+    for name in names:
+        setattr(module, name, timed(getattr(module, name), name))
+
+
+def start_worker():
+    # Called at the start of a forked worker process. Clears the counters and
+    # timers inherited from the parent, so the worker only sends back its own, and
+    # returns the gauges as they were when the worker started.
+    counters.clear()
+    for timer in timers.values():
+        timer[0] = 0.0
+        timer[1] = 0
+    return read_gauges() if read_gauges is not None else {}
+
+
+def worker_totals(start_gauges):
+    # Counters, timers and gauge increases of a worker process, for merge
+    gauges = read_gauges() if read_gauges is not None else {}
+    return (dict(counters), {name: list(timer) for name, timer in timers.items()},
+            {name: value - start_gauges.get(name, 0) for name, value in gauges.items()})
+
+
+def merge(totals):
+    # Adds the totals of a worker process to this process's counters and timers
+    worker_counters, worker_timers, gauge_increases = totals
+    for name, amount in worker_counters.items():
+        count(name, amount)
+    for name, (seconds, calls) in worker_timers.items():
+        timer = timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += calls
+    for name, amount in gauge_increases.items():
+        worker_gauges[name] = worker_gauges.get(name, 0) + amount
+
+
+def report(output="text", gauges=None):
+    # Prints the counters and timers to stderr, as text or as a JSON object.
+    # gauges() returns more counters that are read when the report is printed,
+    # such as the final size of a table. What worker processes added to them is
+    # included.
+    values = dict(counters)
+    if gauges is not None:
+        values.update(gauges())
+    for name, amount in worker_gauges.items():
+        values[name] = values.get(name, 0) + amount
+    if output == "json":
+        result = {"counters": values,
+                  "timers": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in timers.items()}}
+        print(json.dumps(result), file=sys.stderr)
+        return
+    print("Statistics:", file=sys.stderr)
+    for name, value in values.items():
+        print("  " + name + ": " + str(value), file=sys.stderr)
+    for name, (seconds, calls) in timers.items():
+        if calls:
+            print("  " + name + ": " + str(round(seconds, 4)) + " seconds in " + str(calls) + " calls",
+                  file=sys.stderr)
+
+
+def enable(option, gauges=None):
+    # Reads the --stats option and prints the report when the program exits.
+    # Returns False if the option isn't valid.
+    global enabled, read_gauges
+    output = "text" if option is True else option
+    if output not in ("text", "json"):
+        return False
+    enabled = True
+    read_gauges = gauges
+    atexit.register(report, output, gauges)
+    return True
@@ -0,0 +1,131 @@
+# Card probability sweep for the DP agent
+# Solves the game for many card probability vectors (scenarios) at once. The
+# states and moves are the same whatever the probabilities are, so instead of
+# solving the game again for every scenario, every state's value is a vector with
+# one value per scenario and each card's expectation is worked out for all of them
+# with NumPy. Owl configurations are packed like dp_agent.ValueTable and solved a
+# sun position at a time from the end of the sun track, in groups of
+# configurations with the same total owl progress. Moving an owl always increases
+# the total, so every group only depends on groups that are already solved.
+import csv
+import itertools
+import numpy as np
+from engine import cards, board_len, sun_len, is_terminal
+from batch_sim import destinations, binomials
+
+nest = board_len - 1
+sun_card = len(cards) - 1
+
+
+def is_number(text):
+    # Whether text is a number float() accepts
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def read_scenarios(path):
+    # Reads one scenario per CSV row: an optional name followed by a weight for
+    # every card in card order (blue, purple, red, yellow, green, orange, sun).
+    # Weights are scaled to add up to 1, so the number of cards of each kind in a
+    # deck can be used directly. Lines starting with # are skipped, and so is the
+    # first row if none of its card fields are numbers, since it's a header.
+    # Returns the names and a (scenarios, cards) array of probabilities, or raises
+    # ValueError if a row isn't valid.
+    names = []
+    rows = []
+    first = True
+    with open(path) as f:
+        for line_number, fields in enumerate(csv.reader(f), 1):
+            fields = [field.strip() for field in fields]
+            if not fields or not fields[0] or fields[0].startswith("#"):
+                continue
+            header = first and not any(is_number(field) for field in fields[-len(cards):])
+            first = False
+            if header:
+                continue
+            if len(fields) not in (len(cards), len(cards) + 1):
+                raise ValueError("Line " + str(line_number) + " should have an optional name and " +
+                                 str(len(cards)) + " non-negative card weights.")
+            if not all(is_number(field) for field in fields[-len(cards):]):
+                raise ValueError("Line " + str(line_number) + " has an invalid card weight.")
+            weights = [float(field) for field in fields[-len(cards):]]
+            if min(weights) < 0 or sum(weights) <= 0:
+                raise ValueError("Line " + str(line_number) + " should have an optional name and " +
+                                 str(len(cards)) + " non-negative card weights.")
+            names.append(fields[0] if len(fields) > len(cards) else "scenario " + str(len(rows) + 1))
+            rows.append([weight / sum(weights) for weight in weights])
+    if not rows:
+        raise ValueError(path + " has no scenarios.")
+    return names, np.array(rows)
+
+
+def pack(owls, offsets):
+    # Packed ValueTable rank of every row of owl positions, in any order
+    after = np.sort(owls, axis=-1)
+    rank = offsets[(after != nest).sum(axis=-1)]
+    for k in range(owls.shape[-1]):
+        rank = rank + np.where(after[..., k] != nest, binomials[after[..., k], k + 1], 0)
+    return rank
+
+
+def configurations(num_owls):
+    # Owl positions of every configuration, indexed by packed rank, and the offset
+    # of each number of owls off the nest (the same packing as dp_agent.ValueTable)
+    offsets = np.zeros(num_owls + 1, dtype=np.int64)
+    total = 0
+    for off_nest in range(num_owls, -1, -1):
+        offsets[off_nest] = total
+        total += int(binomials[nest, off_nest])
+    owls = np.full((total, num_owls), nest)
+    for off_nest in range(1, num_owls + 1):
+        combos = np.array(list(itertools.combinations(range(nest), off_nest)))
+        owls[pack(np.pad(combos, ((0, 0), (0, num_owls - off_nest)), constant_values=nest), offsets),
+             :off_nest] = combos
+    return owls, offsets
+
+
+def solve(state, probabilities):
+    # Returns the win probability of state for every row of probabilities, which
+    # matches calculate_value with those card probabilities
+    num_owls = len(state) - 1
+    if is_terminal(state):
+        return np.full(len(probabilities), 0.0 if state[-1] == sun_len - 1 else 1.0)
+    owls, offsets = configurations(num_owls)
+    colors = np.tile(np.arange(sun_card), (len(owls), 1))
+
+    # Configurations grouped by total progress, most first, with the rank after
+    # moving each owl with each color (-1 for owls at the nest)
+    totals = owls.sum(axis=1)
+    groups = []
+    for total in np.unique(totals)[::-1]:
+        group = np.flatnonzero(totals == total)
+        group_owls = owls[group]
+        dest = destinations(group_owls, colors[group])
+        after = np.broadcast_to(group_owls[:, None, None, :], dest.shape + (num_owls,)).copy()
+        moved = np.arange(num_owls)
+        after[:, :, moved, moved] = dest
+        next_ranks = np.where(group_owls[:, None, :] != nest, pack(after, offsets), -1)
+        groups.append((group, next_ranks))
+
+    # Values at the end of the sun track are all losses
+    next_values = np.zeros((len(owls), len(probabilities)))
+    for sun in range(sun_len - 2, state[-1] - 1, -1):
+        values = np.empty_like(next_values)
+        for group, next_ranks in groups:
+            if next_ranks.max() == -1:
+                # Every owl is at the nest
+                values[group] = 1.0
+                continue
+            # Same order of operations as calculate_value, so the values match it
+            # exactly
+            win_prob = np.zeros((len(group), len(probabilities)))
+            for card in range(sun_card):
+                moves = np.where(next_ranks[:, card, :, None] != -1, values[next_ranks[:, card]], -np.inf)
+                win_prob += probabilities[:, card] * moves.max(axis=1)
+            win_prob += probabilities[:, sun_card] * next_values[group]
+            values[group] = win_prob
+        next_values = values
+    return next_values[pack(np.array(state[:-1]), offsets)]
@@ -0,0 +1,187 @@
+# Game traces recorded with --trace
+# Every agent's num_games mode can record every move of every game with a
+# TraceWriter. A trace file is read by memory-mapping it as a NumPy array of
+# records, so filtering millions of moves is a handful of array operations and
+# only the pages that are actually read get loaded. NumPy is only imported to
+# read traces, so the agents don't need it to write them.
+import os
+import sys
+import shutil
+import struct
+from engine import cards, sun_len, parse_options
+
+# Game trace file format: a fixed-size header followed by one fixed-width record
+# for every move of every game, in the order they were played. Each record holds
+# the game number, the turn, the owl positions (255 for owls past the number of
+# owls in the game), the sun position, the hand as card indexes, the card played,
+# the owl moved (255 for a sun card) and whether the game was won.
+TRACE_MAGIC = b"HOOTTRC\0"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<8sHH4x")
+TRACE_RECORD = struct.Struct("<IH6BB3BBBBx")
+NO_OWL = 255
+
+# Bytes of records kept in memory before they're written out
+trace_buffer_size = 1 << 20
+
+card_index = {card: c for c, card in enumerate(cards)}
+
+
+class TraceWriter:
+    # Records every move of the games played while it's set as engine.tracer.
+    # Records are packed into a buffer and written out in bulk once it fills up,
+    # always at the end of a game, since whether a game was won is only known once
+    # it ends.
+    def __init__(self, path, first_game=0):
+        self.file = open(path, "wb")
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size))
+        self.buffer = bytearray()
+        self.game = first_game
+        self.turn = 0
+        self.game_start = 0
+
+    def record(self, state, hand, card, owl):
+        owls = list(state[:-1]) + [NO_OWL] * (6 - (len(state) - 1))
+        self.buffer += TRACE_RECORD.pack(self.game, self.turn, *owls, state[-1],
+                                         *[card_index[c] for c in hand], card_index[card],
+                                         NO_OWL if owl is None else owl, 0)
+        self.turn += 1
+
+    def end_game(self, state):
+        if state[-1] != sun_len - 1:
+            # Mark every record of the game as won
+            for offset in range(self.game_start + TRACE_RECORD.size - 2, len(self.buffer), TRACE_RECORD.size):
+                self.buffer[offset] = 1
+        self.game += 1
+        self.turn = 0
+        if len(self.buffer) >= trace_buffer_size:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+        self.game_start = len(self.buffer)
+
+    def close(self):
+        self.file.write(self.buffer)
+        self.file.close()
+
+
+def join(path, parts):
+    # Joins trace files written by several workers into one at path and removes
+    # them. Each part's game numbers already follow on from the one before.
+    with open(path, "wb") as f:
+        f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size))
+        for part in parts:
+            with open(part, "rb") as part_file:
+                part_file.seek(TRACE_HEADER.size)
+                shutil.copyfileobj(part_file, f)
+            os.remove(part)
+
+
+def trace_option(options):
+    # Reads --trace=<file> for the num_games mode, or None if games aren't traced
+    trace = options.get("trace")
+    if trace is True:
+        print("Invalid trace file inputted. Please input --trace=<file>.")
+        exit(1)
+    if trace is not None and "vectorized" in options:
+        print("Games played with --vectorized can't be traced.")
+        exit(1)
+    return trace
+
+
+def record_type():
+    # NumPy type of a record, with the same layout as TRACE_RECORD
+    import numpy as np
+    return np.dtype([("game", "<u4"), ("turn", "<u2"), ("owls", "u1", 6), ("sun", "u1"),
+                     ("hand", "u1", 3), ("card", "u1"), ("owl", "u1"), ("won", "u1"), ("pad", "u1")])
+
+
+def load(path):
+    # Returns the records of a trace file as a read-only memory-mapped array, or
+    # raises ValueError if the file isn't a trace
+    import numpy as np
+    with open(path, "rb") as f:
+        header = f.read(TRACE_HEADER.size)
+    if len(header) < TRACE_HEADER.size or header[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+        raise ValueError(path + " is not a game trace")
+    magic, version, record_size = TRACE_HEADER.unpack(header)
+    if version != TRACE_VERSION or record_size != TRACE_RECORD.size:
+        raise ValueError(path + " uses trace format version " + str(version) + ", expected " +
+                         str(TRACE_VERSION))
+    size = os.path.getsize(path) - TRACE_HEADER.size
+    if size % TRACE_RECORD.size:
+        raise ValueError(path + " is truncated")
+    if size == 0:
+        # Nothing was recorded, and an empty file can't be mapped
+        return np.zeros(0, dtype=record_type())
+    return np.memmap(path, dtype=record_type(), mode="r", offset=TRACE_HEADER.size)
+
+
+def matching_games(records, result=None, sun_past=None, owl_behind=None):
+    # Returns the game numbers of the games with a move where all the conditions
+    # hold: the game was won or lost, the sun was past a position and an owl was
+    # behind a square
+    import numpy as np
+    mask = np.ones(len(records), dtype=bool)
+    if result is not None:
+        mask &= records["won"] == (result == "won")
+    if sun_past is not None:
+        mask &= records["sun"] > sun_past
+    if owl_behind is not None:
+        # Owls past the number of owls in the game are NO_OWL, which is never behind
+        mask &= (records["owls"] < owl_behind).any(axis=1)
+    return np.unique(records["game"][mask])
+
+
+def describe_game(records, game):
+    # Every move of a game, one line each
+    moves = records[records["game"] == game]
+    lines = ["Game " + str(game) + " (" + ("won" if moves["won"][0] else "lost") + ")"]
+    for move in moves:
+        state = [int(pos) for pos in move["owls"] if pos != NO_OWL] + [int(move["sun"])]
+        hand = ",".join(cards[c] for c in move["hand"])
+        if move["owl"] == NO_OWL:
+            action = "played a sun card"
+        else:
+            action = "moved owl " + str(move["owl"] + 1) + " using card " + cards[move["card"]]
+        lines.append("  " + str(state) + " holding " + hand + ": " + action)
+    return lines
+
+
+def main():
+    args, options = parse_options(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage: python3 traces.py <trace file>")
+        print("Options: --result=won|lost --sun-past=<position> --owl-behind=<square> --show=<n>")
+        exit(0)
+    result = options.get("result")
+    if result not in (None, "won", "lost"):
+        print("Invalid result inputted. Please input 'won' or 'lost'.")
+        exit(1)
+    try:
+        sun_past = int(options["sun-past"]) if "sun-past" in options else None
+        owl_behind = int(options["owl-behind"]) if "owl-behind" in options else None
+        show = int(options.get("show", 0))
+    except ValueError:
+        print("Invalid option inputted. Positions, squares and the number of games to show should be integers.")
+        exit(1)
+    if sun_past is not None and not 0 <= sun_past < sun_len:
+        print("Invalid sun position inputted. Please input a position from 0 to " + str(sun_len - 1) + ".")
+        exit(1)
+
+    try:
+        records = load(args[0])
+    except (OSError, ValueError) as e:
+        print("Could not load trace: " + str(e))
+        exit(1)
+    first_moves = records["turn"] == 0
+    num_games = int(first_moves.sum())
+    games = matching_games(records, result, sun_past, owl_behind)
+    print(str(len(records)) + " moves from " + str(num_games) + " games, " +
+          str(int(records["won"][first_moves].sum())) + " won")
+    print(str(len(games)) + " games match")
+    for game in games[:show]:
+        print("\n".join(describe_game(records, game)))
+
+
+if __name__ == "__main__":
+    main()